@@ -6,6 +6,7 @@ from config import BOT_TOKEN
 from handlers import common, food_log, edit_log
 from database import db
 from utils import scheduler
+from services.sync_outbox import sync_outbox
 from aiohttp import web
 import os
 
@@ -51,7 +52,10 @@ async def main():
     dp.include_router(edit_log.router)
     
     # Start Scheduler
-    scheduler.start_scheduler()
+    await scheduler.start_scheduler()
+
+    # Фоновая отправка отчетов в Google Docs
+    sync_outbox.start()
     
     print("Bot started...")
     # Start Health Check Server (Koyeb requirement)
@@ -60,7 +64,9 @@ async def main():
     try:
         await dp.start_polling(bot)
     finally:
+        await sync_outbox.stop()
         await bot.session.close()
+        await db.close_db()
         print("Bot stopped gracefully.")
 
 if __name__ == "__main__":
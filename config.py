@@ -7,6 +7,34 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# LLM: адрес API (можно указать локальный сервер), лимит параллельных запросов и таймаут (сек)
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+# Резервный провайдер Gemini (используется, если задан GEMINI_API_KEY)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# Hedging: если основной провайдер не ответил за перцентиль своей задержки, запрос дублируется резервному.
+# Пока замеров мало, используется LLM_HEDGE_DELAY (сек)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "2"))
+
+# Google Docs: адрес API (можно указать локальный сервер) и число потоков для блокирующих вызовов
+GOOGLE_DOCS_ENDPOINT = os.getenv("GOOGLE_DOCS_ENDPOINT")
+GOOGLE_SYNC_WORKERS = int(os.getenv("GOOGLE_SYNC_WORKERS", "4"))
+
+# Каталог файлов SQLite (база, ее -wal/-shm и архив) — в Docker это должен быть примонтированный том
+DB_DIR = os.getenv("DB_DIR", ".")
+
+# Пул соединений SQLite: один писатель + DB_READERS читателей
+DB_READERS = int(os.getenv("DB_READERS", "3"))
+
+# Записи старше ARCHIVE_AFTER_DAYS дней переносятся ночным обслуживанием в архивную базу (DB_DIR/bot_archive.db)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is not set in .env")
 # GROQ_API_KEY будет проверяться при импорте groq_ai
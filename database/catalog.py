@@ -0,0 +1,123 @@
+import logging
+from collections import defaultdict
+
+NGRAM_SIZE = 3
+
+
+def normalize_name(name):
+    """Нормализация названия: сортировка слов (защита от перестановки)."""
+    return " ".join(sorted(name.split()))
+
+
+def _ngrams(text, n=NGRAM_SIZE):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class CatalogIndex:
+    """
+    Индекс справочника продуктов в памяти процесса.
+    Хранит строки таблицы products: (id, name, kcal_per_100g, last_verified, is_verified).
+
+    Порядок поиска повторяет прежний get_product:
+    1. точное совпадение названия;
+    2. совпадение по отсортированным словам;
+    3. подстрока в любую сторону — выигрывает самое короткое название.
+    """
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_tokens = defaultdict(dict)
+        self._by_ngram = defaultdict(set)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def load(self, rows):
+        self._by_name.clear()
+        self._by_tokens.clear()
+        self._by_ngram.clear()
+        for row in rows:
+            self.add(row)
+
+    def add(self, row):
+        name = row[1]
+        if name in self._by_name:
+            self.remove(name)
+        self._by_name[name] = row
+        self._by_tokens[normalize_name(name)][name] = row
+        for gram in _ngrams(name):
+            self._by_ngram[gram].add(name)
+
+    def remove(self, name):
+        row = self._by_name.pop(name, None)
+        if row is None:
+            return
+        key = normalize_name(name)
+        same_tokens = self._by_tokens.get(key)
+        if same_tokens is not None:
+            same_tokens.pop(name, None)
+            if not same_tokens:
+                del self._by_tokens[key]
+        for gram in _ngrams(name):
+            names = self._by_ngram.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._by_ngram[gram]
+
+    def lookup(self, name):
+        name_lower = name.lower().strip()
+        row = self.lookup_exact(name_lower)
+        if row:
+            return row
+
+        # 3. Подстроки: название из базы внутри запроса или запрос внутри названия
+        candidates = self._names_inside(name_lower) | self._names_containing(name_lower)
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda n: (len(n), self._by_name[n][0]))
+        return self._by_name[best]
+
+    def lookup_exact(self, name):
+        """Только шаги 1-2 (точное название или те же слова), без подстрок."""
+        name_lower = name.lower().strip()
+
+        # 1. Точное совпадение
+        row = self._by_name.get(name_lower)
+        if row:
+            return row
+
+        # 2. Совпадение по отсортированным словам
+        same_tokens = self._by_tokens.get(normalize_name(name_lower))
+        if same_tokens:
+            row = min(same_tokens.values(), key=lambda r: r[0])
+            logging.info(f"MATCH (Normalized): '{name_lower}' -> '{row[1]}'")
+            return row
+        return None
+
+    def _names_inside(self, text):
+        """Названия из базы, которые целиком входят в text."""
+        found = set()
+        length = len(text)
+        for start in range(length):
+            for end in range(start + 1, length + 1):
+                if text[start:end] in self._by_name:
+                    found.add(text[start:end])
+        return found
+
+    def _names_containing(self, text):
+        """Названия из базы, которые содержат text."""
+        grams = _ngrams(text)
+        if not grams:
+            # Слишком короткий запрос для n-грамм — проверяем все названия
+            return {n for n in self._by_name if text in n}
+        postings = sorted((self._by_ngram.get(g, set()) for g in grams), key=len)
+        candidates = set(postings[0])
+        for names in postings[1:]:
+            candidates &= names
+            if not candidates:
+                break
+        return {n for n in candidates if text in n}
+
+
+catalog = CatalogIndex()
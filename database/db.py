@@ -1,18 +1,360 @@
 import aiosqlite
+import asyncio
 import os
 import datetime
-import json
-from config import USER_TZ
+import logging
+from contextlib import asynccontextmanager
+from config import USER_TZ, DB_READERS, DB_DIR
+from .catalog import catalog, CatalogIndex
+from .product_journal import ProductJournal
+from .models import parse_legacy_timestamp
 
-DB_PATH = "bot_database.db"
+DB_PATH = os.path.join(DB_DIR, "bot_database.db")
+ARCHIVE_PATH = os.path.join(DB_DIR, "bot_archive.db")
 JSON_PATH = "initial_products.json"
+JOURNAL_PATH = "initial_products.journal.jsonl"
+
+product_journal = ProductJournal(JSON_PATH, JOURNAL_PATH)
+
+# Настройки соединений (применяются к каждому соединению пула)
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",   # в режиме WAL безопасно и без fsync на каждый commit
+    "PRAGMA cache_size = -16000",    # ~16 МБ страничного кэша
+    "PRAGMA mmap_size = 134217728",  # 128 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+# Размер кэша подготовленных выражений sqlite3 (на соединение)
+STATEMENT_CACHE_SIZE = 256
+
+# Архив старых записей подключается к каждому соединению как схема archive.
+# Столбцы архивных таблиц совпадают с основными: миграции daily_logs/meals должны менять и их.
+ARCHIVE_PRAGMAS = (
+    "PRAGMA archive.journal_mode = WAL",
+    "PRAGMA archive.synchronous = NORMAL",
+)
+LOG_COLUMNS = "id, user_id, meal_id, timestamp, product_name, weight_g, kcal_total, log_date, product_id, kcal_source"
+MEAL_COLUMNS = "id, user_id, last_report_message_id, created_at, updated_at"
+ARCHIVE_HORIZON_STATE = "archive_horizon"
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS archive.meals (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        last_report_message_id INTEGER,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS archive.daily_logs (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        meal_id TEXT,
+        timestamp TIMESTAMP,
+        product_name TEXT,
+        weight_g REAL,
+        kcal_total REAL,
+        log_date TEXT,
+        product_id INTEGER,
+        kcal_source TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_daily_logs_user_date ON daily_logs(user_id, log_date)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_daily_logs_meal ON daily_logs(meal_id)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_daily_logs_product ON daily_logs(product_id, log_date)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_meals_user_created ON meals(user_id, created_at)",
+)
+# Записи из основной базы и архива вместе (временное представление в каждом соединении).
+# Условия WHERE SQLite переносит в обе части UNION ALL, поэтому каждая часть идет по своему индексу
+ALL_LOGS_VIEW = f"""
+    CREATE TEMP VIEW IF NOT EXISTS all_daily_logs AS
+    SELECT {LOG_COLUMNS} FROM main.daily_logs
+    UNION ALL
+    SELECT {LOG_COLUMNS} FROM archive.daily_logs
+"""
+
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с SQLite: один писатель и N читателей.
+    Писатель сериализуется через lock, читатели выдаются из очереди.
+    К каждому соединению подключен архив (схема archive) и представление all_daily_logs.
+    """
+
+    def __init__(self, path, archive_path, readers=DB_READERS):
+        self.path = path
+        self.archive_path = archive_path
+        # Записи с log_date раньше этой даты ('YYYY-MM-DD') могут лежать в архиве; None — архив пуст
+        self.archive_horizon = None
+        self.readers_count = max(1, readers)
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self, read_only=False):
+        conn = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        await conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        for pragma in ARCHIVE_PRAGMAS:
+            await conn.execute(pragma)
+        await conn.execute(ALL_LOGS_VIEW)
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        # Писатель открывается первым: он переводит базу в WAL
+        self._writer = await self._connect()
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        logging.info(f"DB pool opened: 1 writer, {self.readers_count} readers ({self.path})")
+
+    async def close(self):
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers = []
+            self._readers = None
+            await self._writer.close()
+            self._writer = None
+        logging.info("DB pool closed.")
+
+    @asynccontextmanager
+    async def writer(self):
+        """Единственное пишущее соединение. Commit при успехе, rollback при ошибке."""
+        if not self.is_open:
+            raise RuntimeError("DB pool is not open. Call init_db() first.")
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def reader(self):
+        """Читающее соединение из пула (видит последнее закоммиченное состояние)."""
+        if not self.is_open:
+            raise RuntimeError("DB pool is not open. Call init_db() first.")
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+
+pool = ConnectionPool(DB_PATH, ARCHIVE_PATH)
+
+# Столбцы со временем, которые хранятся как секунды Unix: (таблица, [столбцы])
+EPOCH_COLUMNS = (
+    ("users", ["created_at"]),
+    ("meals", ["created_at", "updated_at"]),
+    ("daily_logs", ["timestamp"]),
+)
+
+async def _migrate_timestamps_to_epoch(db):
+    """Строки datetime из старой схемы -> целые секунды Unix (время без пояса считается USER_TZ)."""
+    for table, columns in EPOCH_COLUMNS:
+        async with db.execute(f"SELECT rowid, {', '.join(columns)} FROM {table}") as cursor:
+            rows = await cursor.fetchall()
+        updates = [(*[parse_legacy_timestamp(value) for value in values], rowid) for rowid, *values in rows]
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        await db.executemany(f"UPDATE {table} SET {assignments} WHERE rowid = ?", updates)
+        logging.info(f"Migrated {len(updates)} {table} rows to epoch timestamps")
+
+async def _log_schemas(db):
+    """Схемы, в которых уже есть таблица daily_logs (архив создается после миграций)."""
+    schemas = ["main"]
+    async with db.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'daily_logs'") as cursor:
+        if await cursor.fetchone():
+            schemas.append("archive")
+    return schemas
+
+async def _link_logs_to_products(db):
+    """
+    Заполняет product_id записей с неизвестным источником калорийности (старые записи).
+    Ссылка ставится только при точном совпадении названия или слов (без подстрок: «сырники» — не «сыр»)
+    и только если kcal_total совпадает с весом по калорийности продукта, т.е. взят из справочника.
+    Остальные записи остаются без ссылки: пересчет их не трогает.
+    """
+    index = CatalogIndex()
+    async with db.execute("SELECT * FROM products") as cursor:
+        index.load(await cursor.fetchall())
+    for schema in await _log_schemas(db):
+        table = f"{schema}.daily_logs"
+        async with db.execute(f"SELECT DISTINCT product_name FROM {table} WHERE product_id IS NULL AND kcal_source IS NULL") as cursor:
+            names = [row[0] for row in await cursor.fetchall()]
+        links = []
+        for name in names:
+            product = index.lookup_exact(name) if name else None
+            if product:
+                links.append((product[0], name, product[2]))
+        before = db.total_changes
+        await db.executemany(f"""
+            UPDATE {table} SET product_id = ?, kcal_source = 'catalog'
+            WHERE product_name = ? AND product_id IS NULL AND kcal_source IS NULL
+              AND weight_g > 0 AND abs(kcal_total - weight_g * ? / 100.0) < 0.01
+        """, links)
+        logging.info(f"Linked {db.total_changes - before} {table} rows ({len(links)}/{len(names)} names) to the catalog")
+
+async def _add_kcal_source(db):
+    """
+    daily_logs.kcal_source — откуда взята калорийность записи: 'catalog' (справочник, есть product_id),
+    'manual' (введена пользователем), 'ai' (оценка ИИ). У старых записей источник неизвестен (NULL).
+    Ссылки миграции 8 (поиск с подстроками, без проверки калорийности) сбрасываются и ставятся заново.
+    """
+    for schema in await _log_schemas(db):
+        await db.execute(f"ALTER TABLE {schema}.daily_logs ADD COLUMN kcal_source TEXT")
+        await db.execute(f"UPDATE {schema}.daily_logs SET product_id = NULL")
+    await _link_logs_to_products(db)
+
+# Версионированные миграции схемы. Текущая версия хранится в PRAGMA user_version.
+# Каждая миграция применяется в отдельной транзакции: (версия, [SQL, ...]).
+MIGRATIONS = [
+    (1, [
+        # Хранимая дата записи вместо substr(timestamp, 1, 10) + индексы
+        "ALTER TABLE daily_logs ADD COLUMN log_date TEXT",
+        "UPDATE daily_logs SET log_date = substr(timestamp, 1, 10)",
+        "CREATE INDEX IF NOT EXISTS idx_daily_logs_user_date ON daily_logs(user_id, log_date)",
+        "CREATE INDEX IF NOT EXISTS idx_daily_logs_meal ON daily_logs(meal_id)",
+        "CREATE INDEX IF NOT EXISTS idx_meals_user_created ON meals(user_id, created_at)",
+    ]),
+    (2, [
+        # Кэш ответов LLM о калорийности (kcal = NULL — негативная запись)
+        """
+        CREATE TABLE IF NOT EXISTS calorie_cache (
+            key TEXT PRIMARY KEY,
+            kcal INTEGER,
+            expires_at REAL
+        )
+        """,
+    ]),
+    (3, [
+        # Состояние фоновых задач (курсор проверки справочника) и найденные расхождения калорийности
+        """
+        CREATE TABLE IF NOT EXISTS job_state (
+            name TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS product_review (
+            product_id INTEGER PRIMARY KEY,
+            name TEXT,
+            current_kcal INTEGER,
+            suggested_kcal INTEGER,
+            found_at TIMESTAMP,
+            FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_products_last_verified ON products(last_verified, id)",
+    ]),
+    (4, [
+        # Записи всех пользователей за день одним запросом (ночная синхронизация)
+        "CREATE INDEX IF NOT EXISTS idx_daily_logs_date ON daily_logs(log_date, user_id, timestamp)",
+    ]),
+    (5, [
+        # Очередь отправки отчетов в Google Docs. Один и тот же текст (hash) за день попадает в документ один раз
+        """
+        CREATE TABLE IF NOT EXISTS sync_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            log_date TEXT,
+            doc_id TEXT,
+            content_hash TEXT,
+            report_text TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            last_error TEXT,
+            created_at TIMESTAMP,
+            delivered_at TIMESTAMP,
+            UNIQUE(doc_id, user_id, log_date, content_hash)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sync_outbox_due ON sync_outbox(status, next_attempt_at)",
+    ]),
+    (6, [
+        # Итоги по дням, поддерживаются функциями записи в той же транзакции
+        """
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            user_id INTEGER,
+            log_date TEXT,
+            kcal_total REAL,
+            meal_count INTEGER,
+            item_count INTEGER,
+            PRIMARY KEY (user_id, log_date)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT OR REPLACE INTO daily_summary (user_id, log_date, kcal_total, meal_count, item_count)
+        SELECT user_id, log_date, SUM(kcal_total), COUNT(DISTINCT meal_id), COUNT(*)
+        FROM daily_logs GROUP BY user_id, log_date
+        """,
+    ]),
+    (7, [
+        # Время — целые секунды Unix вместо строк; локальная дата уже хранится в daily_logs.log_date
+        _migrate_timestamps_to_epoch,
+    ]),
+    (8, [
+        # Ссылка на справочник: при исправлении калорийности продукта его записи находятся по индексу
+        "ALTER TABLE daily_logs ADD COLUMN product_id INTEGER REFERENCES products(id) ON DELETE SET NULL",
+        "CREATE INDEX IF NOT EXISTS idx_daily_logs_product ON daily_logs(product_id, log_date)",
+    ]),
+    (9, [
+        # Источник калорийности записи: связываются и пересчитываются только записи из справочника
+        _add_kcal_source,
+    ]),
+]
+
+async def get_schema_version(db):
+    async with db.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0]
+
+async def run_migrations(db):
+    """Применяет миграции, которые новее текущей версии схемы."""
+    version = await get_schema_version(db)
+    for target, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        await db.execute("BEGIN")
+        for step in steps:
+            if callable(step):
+                await step(db)
+            else:
+                await db.execute(step)
+        await db.execute(f"PRAGMA user_version = {target}")
+        await db.commit()
+        logging.info(f"DB migrated to schema version {target}")
 
 async def get_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         yield db
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    await pool.open()
+    async with pool.writer() as db:
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY,
@@ -52,35 +394,92 @@ async def init_db():
             )
         """)
         await db.commit()
+        await run_migrations(db)
+        for statement in ARCHIVE_SCHEMA:
+            await db.execute(statement)
         await seed_products(db)
 
+        async with db.execute("SELECT value FROM job_state WHERE name = ?", (ARCHIVE_HORIZON_STATE,)) as cursor:
+            row = await cursor.fetchone()
+            pool.archive_horizon = row[0] if row else None
+
+    # Индекс справочника продуктов для get_product
+    async with pool.reader() as db:
+        async with db.execute("SELECT * FROM products") as cursor:
+            catalog.load(await cursor.fetchall())
+    logging.info(f"Product catalog indexed: {len(catalog)} products")
+
+async def _file_stats(db, schema):
+    stats = {}
+    for pragma in ("page_count", "page_size", "freelist_count"):
+        async with db.execute(f"PRAGMA {schema}.{pragma}") as cursor:
+            stats[pragma] = (await cursor.fetchone())[0]
+    return stats["page_count"] * stats["page_size"], stats["freelist_count"]
+
+async def run_maintenance():
+    """
+    Обслуживание базы в тихие часы: возврат свободных страниц (incremental vacuum),
+    статистика для планировщика запросов (ANALYZE) и сброс WAL в файлы базы (checkpoint).
+    Возвращает {схема: (размер до, размер после, освобождено страниц)}.
+    """
+    result = {}
+    async with pool.writer() as db:
+        for schema in ("main", "archive"):
+            async with db.execute(f"PRAGMA {schema}.auto_vacuum") as cursor:
+                mode = (await cursor.fetchone())[0]
+            if mode != 2:
+                # Режим INCREMENTAL включается только полной пересборкой файла — один раз
+                logging.info(f"DB maintenance: enabling incremental auto_vacuum for {schema} (full VACUUM)")
+                await db.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                await db.execute(f"VACUUM {schema}")
+
+        for schema in ("main", "archive"):
+            size_before, free = await _file_stats(db, schema)
+            async with db.execute(f"PRAGMA {schema}.incremental_vacuum") as cursor:
+                await cursor.fetchall()
+            size_after, _ = await _file_stats(db, schema)
+            result[schema] = (size_before, size_after, free)
+        await db.execute("ANALYZE")
+
+    # Checkpoint вне транзакции: TRUNCATE обнуляет файл WAL, если читатели не держат снимок
+    async with pool.writer() as db:
+        for schema in ("main", "archive"):
+            async with db.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)") as cursor:
+                busy, _, _ = await cursor.fetchone()
+            if busy:
+                logging.warning(f"DB maintenance: {schema} WAL checkpoint was blocked by readers")
+    return result
+
+async def close_db():
+    await product_journal.flush()
+    await pool.close()
+
 async def seed_products(db):
     async with db.execute("SELECT COUNT(*) FROM products") as cursor:
         count = await cursor.fetchone()
         if count[0] > 0:
             return
 
-    if not os.path.exists(JSON_PATH):
+    if not os.path.exists(JSON_PATH) and not os.path.exists(JOURNAL_PATH):
         print(f"Warning: {JSON_PATH} not found. Seeding skipped.")
         return
 
     print("Seeding database from JSON...")
     try:
-        with open(JSON_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
+        # Снимок + журнал изменений, которые еще не попали в снимок
+        data = product_journal.load_products()
+
         products = []
         now = datetime.datetime.now(USER_TZ)
-        
+
         for item in data:
             products.append((item['name'], item['kcal'], now, True))
-            
+
         await db.executemany("""
             INSERT OR IGNORE INTO products (name, kcal_per_100g, last_verified, is_verified)
             VALUES (?, ?, ?, ?)
         """, products)
-        await db.commit()
         print(f"Seeded {len(products)} products from JSON.")
-        
+
     except Exception as e:
-        print(f"Error seeding database: {e}")
\ No newline at end of file
+        print(f"Error seeding database: {e}")
@@ -0,0 +1,77 @@
+import datetime
+from config import USER_TZ
+
+# Время в базе хранится целым числом секунд Unix (UTC), дата записи — отдельно в локальном поясе (log_date)
+
+
+def to_epoch(value):
+    """datetime -> секунды Unix. Время без пояса считается временем USER_TZ."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=USER_TZ)
+    return int(value.timestamp())
+
+
+def from_epoch(value):
+    """Секунды Unix -> datetime в USER_TZ."""
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, USER_TZ)
+
+
+def day_bounds(date: datetime.date):
+    """Границы локального дня [начало, начало следующего дня) в секундах Unix."""
+    start = datetime.datetime.combine(date, datetime.time(), tzinfo=USER_TZ)
+    return to_epoch(start), to_epoch(start + datetime.timedelta(days=1))
+
+
+def parse_legacy_timestamp(value):
+    """
+    Значение из старой схемы (строка datetime с поясом или без, либо число) -> секунды Unix.
+    Используется только миграцией.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip()
+    try:
+        return to_epoch(datetime.datetime.fromisoformat(value))
+    except ValueError:
+        # Нестандартный хвост (микросекунды/пояс) — берем 'YYYY-MM-DD HH:MM:SS'
+        return to_epoch(datetime.datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S"))
+
+
+class LogRow:
+    """Запись дневника (daily_logs)."""
+    __slots__ = ("id", "meal_id", "timestamp", "product_name", "weight_g", "kcal_total", "log_date")
+
+    COLUMNS = "id, meal_id, timestamp, product_name, weight_g, kcal_total, log_date"
+
+    def __init__(self, id, meal_id, timestamp, product_name, weight_g, kcal_total, log_date):
+        self.id = id
+        self.meal_id = meal_id
+        self.timestamp = from_epoch(timestamp)
+        self.product_name = product_name
+        self.weight_g = weight_g
+        self.kcal_total = kcal_total
+        self.log_date = datetime.date.fromisoformat(log_date)
+
+    def __repr__(self):
+        return f"LogRow({self.id}, {self.product_name!r}, {self.weight_g}г, {self.kcal_total} ккал, {self.timestamp:%Y-%m-%d %H:%M})"
+
+
+class MealRow:
+    """Прием пищи (meals)."""
+    __slots__ = ("id", "user_id", "last_report_message_id", "created_at", "updated_at")
+
+    COLUMNS = "id, user_id, last_report_message_id, created_at, updated_at"
+
+    def __init__(self, id, user_id, last_report_message_id, created_at, updated_at):
+        self.id = id
+        self.user_id = user_id
+        self.last_report_message_id = last_report_message_id
+        self.created_at = from_epoch(created_at)
+        self.updated_at = from_epoch(updated_at)
+
+    def __repr__(self):
+        return f"MealRow({self.id!r}, user={self.user_id}, updated={self.updated_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+# Задержка перед пересборкой снимка: серия изменений дает одну запись файла
+COMPACT_DELAY = 30
+
+
+class ProductJournal:
+    """
+    Журнал изменений справочника продуктов (JSONL, только дозапись).
+    Снимок (initial_products.json) пересобирается в фоне: снимок + журнал -> временный файл -> rename.
+    """
+
+    def __init__(self, snapshot_path, journal_path, compact_delay=COMPACT_DELAY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_delay = compact_delay
+        self._lock = threading.Lock()
+        self._compact_task = None
+
+    async def append(self, records):
+        """Дописывает записи вида {"op": "add"|"delete", "name": ..., "kcal": ...} одной операцией."""
+        if not records:
+            return
+        await asyncio.to_thread(self._append_sync, records)
+        self._schedule_compaction()
+
+    def _append_sync(self, records):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with self._lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _schedule_compaction(self):
+        # Debounce: каждое новое изменение откладывает пересборку снимка
+        if self._compact_task and not self._compact_task.done():
+            self._compact_task.cancel()
+        self._compact_task = asyncio.create_task(self._compact_later())
+
+    async def _compact_later(self):
+        await asyncio.sleep(self.compact_delay)
+        await asyncio.to_thread(self.compact)
+
+    async def flush(self):
+        """Немедленно переносит журнал в снимок (вызывается при остановке)."""
+        if self._compact_task and not self._compact_task.done():
+            self._compact_task.cancel()
+        self._compact_task = None
+        await asyncio.to_thread(self.compact)
+
+    def load_products(self):
+        """Текущий справочник: снимок с примененным поверх журналом."""
+        with self._lock:
+            return list(self._replay().values())
+
+    def compact(self):
+        with self._lock:
+            if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+                return
+            data = list(self._replay().values())
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.replace(tmp_path, self.snapshot_path)
+            except OSError:
+                # Снимок смонтирован как отдельный файл (docker volume) — rename невозможен
+                with open(tmp_path, "r", encoding="utf-8") as src, open(self.snapshot_path, "w", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(tmp_path)
+            # Журнал очищается только после успешной замены снимка
+            open(self.journal_path, "w", encoding="utf-8").close()
+        logging.info(f"JSON snapshot compacted: {len(data)} products")
+
+    def _replay(self):
+        products = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                for p in json.load(f):
+                    products[p['name']] = p
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка после сбоя — пропускаем
+                        logging.warning(f"Skipping broken journal line: {line[:80]}")
+                        continue
+                    name = record['name']
+                    # Удаляем старый если есть, и добавляем новый в конец
+                    products.pop(name, None)
+                    if record['op'] == "add":
+                        products[name] = {"name": name, "kcal": record['kcal']}
+        return products
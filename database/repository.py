@@ -1,221 +1,625 @@
-import aiosqlite
 import datetime
+import hashlib
 import logging
-import json
-import os
-from .db import DB_PATH, JSON_PATH
+import time
+from .db import pool, product_journal, LOG_COLUMNS, MEAL_COLUMNS, ARCHIVE_HORIZON_STATE
+from .catalog import catalog
+from .models import LogRow, MealRow, to_epoch, from_epoch, day_bounds
 from config import USER_TZ
 
+async def _ensure_user(db, user_id):
+    """Строка users для пользователя (нужна внешним ключам meals/daily_logs) в текущей транзакции."""
+    now = to_epoch(datetime.datetime.now(USER_TZ))
+    await db.execute("INSERT OR IGNORE INTO users (id, created_at) VALUES (?, ?)", (user_id, now))
+
 async def add_user(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        now = datetime.datetime.now(USER_TZ)
-        await db.execute("INSERT OR IGNORE INTO users (id, created_at) VALUES (?, ?)", (user_id, now))
-        await db.commit()
+    async with pool.writer() as db:
+        await _ensure_user(db, user_id)
 
 async def get_product(name):
-    async with aiosqlite.connect(DB_PATH) as db:
-        name_lower = name.lower().strip()
-        
-        # Функция для нормализации (сортировки слов)
-        def normalize_name(n):
-            return " ".join(sorted(n.split()))
-
-        target_norm = normalize_name(name_lower)
-
-        # 1. Сначала ищем точное совпадение
-        async with db.execute("SELECT * FROM products WHERE name = ?", (name_lower,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return row
-        
-        # 2. Поиск по нормализованным словам (защита от перестановки)
-        # Получаем все продукты и ищем совпадение по отсортированным словам
-        async with db.execute("SELECT * FROM products") as cursor:
-            async for row in cursor:
-                db_name_norm = normalize_name(row[1]) # row[1] это name
-                if db_name_norm == target_norm:
-                    logging.info(f"MATCH (Normalized): '{name_lower}' -> '{row[1]}'")
-                    return row
-
-        # 3. Нечеткий поиск (LIKE) если точного по словам нет
-        async with db.execute("""
-            SELECT * FROM products 
-            WHERE ? LIKE '%' || name || '%' 
-               OR name LIKE '%' || ? || '%'
-            ORDER BY length(name) ASC
-            LIMIT 1
-        """, (name_lower, name_lower)) as cursor:
-            return await cursor.fetchone()
+    """Поиск продукта по индексу справочника в памяти (без запросов к SQLite)."""
+    return catalog.lookup(name)
 
 async def add_product(name, kcal, is_verified=True):
-    name = name.lower().strip()
-    async with aiosqlite.connect(DB_PATH) as db:
+    await add_products([(name, kcal)], is_verified=is_verified)
+
+async def add_products(items, is_verified=True):
+    """
+    Добавляет/обновляет несколько продуктов одной транзакцией. items: список (name, kcal).
+    Записи дневника с этим названием по оценке ИИ, чья калорийность совпадает с сохраняемой,
+    получают ссылку на продукт. Введенные вручную и старые записи (источник неизвестен) не связываются.
+    """
+    raw_names = [name for name, _ in items]
+    items = [(name.lower().strip(), kcal) for name, kcal in items]
+    if not items:
+        return
+    names = [name for name, _ in items]
+    async with pool.writer() as db:
         now = datetime.datetime.now(USER_TZ)
-        await db.execute("""
-            INSERT OR REPLACE INTO products (name, kcal_per_100g, last_verified, is_verified)
+        # UPSERT, а не REPLACE: id продукта не меняется и ссылки из daily_logs остаются целыми
+        await db.executemany("""
+            INSERT INTO products (name, kcal_per_100g, last_verified, is_verified)
             VALUES (?, ?, ?, ?)
-        """, (name, kcal, now, is_verified))
-        await db.commit()
+            ON CONFLICT(name) DO UPDATE SET
+                kcal_per_100g = excluded.kcal_per_100g,
+                last_verified = excluded.last_verified,
+                is_verified = excluded.is_verified
+        """, [(name, kcal, now, is_verified) for name, kcal in items])
+        placeholders = ",".join(["?"] * len(names))
+        async with db.execute(f"SELECT * FROM products WHERE name IN ({placeholders})", names) as cursor:
+            rows = await cursor.fetchall()
+        ids = {row[1]: row[0] for row in rows}
+        # Название в логе — как его вернул разбор (регистр мог отличаться)
+        links = {
+            (ids[name], logged, kcal)
+            for logged, (name, kcal) in zip(raw_names, items) for logged in (logged, name)
+        }
+        await db.executemany("""
+            UPDATE daily_logs SET product_id = ?, kcal_source = 'catalog'
+            WHERE product_name = ? AND product_id IS NULL AND kcal_source = 'ai'
+              AND weight_g > 0 AND abs(kcal_total - weight_g * ? / 100.0) < 0.01
+        """, list(links))
+    for row in rows:
+        catalog.add(row)
     
     # Sync to JSON
-    await sync_product_to_json(name, kcal, action="add")
+    await sync_products_to_json(items, action="add")
 
 async def sync_product_to_json(name, kcal=None, action="add"):
-    """Синхронизирует изменения с JSON файлом (Золотой стандарт)"""
+    await sync_products_to_json([(name, kcal)], action=action)
+
+async def sync_products_to_json(items, action="add"):
+    """
+    Синхронизирует изменения с JSON файлом (Золотой стандарт).
+    Изменения дописываются в журнал одной записью, сам JSON пересобирается в фоне.
+    """
     try:
-        data = []
-        if os.path.exists(JSON_PATH):
-            with open(JSON_PATH, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        
         if action == "add":
-            # Удаляем старый если есть, и добавляем новый
-            data = [p for p in data if p['name'] != name]
-            data.append({"name": name, "kcal": int(kcal)})
-        elif action == "delete":
-            data = [p for p in data if p['name'] != name]
-            
-        with open(JSON_PATH, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        logging.info(f"JSON synced: {action} {name}")
+            records = [{"op": "add", "name": name, "kcal": int(kcal)} for name, kcal in items]
+        else:
+            records = [{"op": "delete", "name": name} for name, _ in items]
+        await product_journal.append(records)
+        logging.info(f"JSON journal: {action} {', '.join(name for name, _ in items)}")
     except Exception as e:
         logging.error(f"Error syncing to JSON: {e}")
 
 async def create_meal(meal_id, user_id, message_id=None, timestamp=None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        now = timestamp if timestamp else datetime.datetime.now(USER_TZ)
+    async with pool.writer() as db:
+        now = to_epoch(timestamp if timestamp else datetime.datetime.now(USER_TZ))
+        # Пользователь мог не вызывать /start (например, база пересоздана после деплоя)
+        await _ensure_user(db, user_id)
         await db.execute("INSERT INTO meals (id, user_id, last_report_message_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)", (meal_id, user_id, message_id, now, now))
-        await db.commit()
 
 async def update_meal_report_id(meal_id, message_id):
-     async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("UPDATE meals SET last_report_message_id = ? WHERE id = ?", (message_id, meal_id))
-        await db.commit()
+
+async def get_day_report_message_id(user_id, date: datetime.date):
+    """Последнее сообщение с отчетом за день (по приемам пищи этого дня) или None."""
+    day_start, day_end = day_bounds(date)
+    async with pool.reader() as db:
+        async with db.execute("""
+            SELECT MAX(last_report_message_id) FROM meals
+            WHERE user_id = ? AND created_at >= ? AND created_at < ?
+        """, (user_id, day_start, day_end)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+async def set_day_report_message_id(user_id, date: datetime.date, message_id):
+    """Запоминает сообщение с отчетом за день во всех приемах пищи этого дня."""
+    day_start, day_end = day_bounds(date)
+    async with pool.writer() as db:
+        await db.execute("""
+            UPDATE meals SET last_report_message_id = ?
+            WHERE user_id = ? AND created_at >= ? AND created_at < ?
+        """, (message_id, user_id, day_start, day_end))
 
 async def get_last_meal(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         # Get the most recent meal
-        async with db.execute("""
-            SELECT * FROM meals 
+        async with db.execute(f"""
+            SELECT {MealRow.COLUMNS} FROM meals 
             WHERE user_id = ? 
             ORDER BY created_at DESC 
             LIMIT 1
         """, (user_id,)) as cursor:
             row = await cursor.fetchone()
             if row:
-                return row
+                return MealRow(*row)
             return None
 
 async def update_meal_time(meal_id):
-    async with aiosqlite.connect(DB_PATH) as db:
-        now = datetime.datetime.now(USER_TZ)
+    async with pool.writer() as db:
+        now = to_epoch(datetime.datetime.now(USER_TZ))
         await db.execute("UPDATE meals SET updated_at = ? WHERE id = ?", (now, meal_id))
-        await db.commit()
 
-async def add_log(user_id, meal_id, product_name, weight, kcal, timestamp=None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        now = timestamp if timestamp else datetime.datetime.now(USER_TZ)
+# Пачка переноса в архив (id в одном IN, в пределах лимита параметров SQLite)
+ARCHIVE_BATCH_SIZE = 500
+
+def _logs_table(start_date_str):
+    """Откуда читать записи начиная с даты: архив подключается, только если период его задевает."""
+    horizon = pool.archive_horizon
+    return "all_daily_logs" if horizon and start_date_str < horizon else "daily_logs"
+
+async def _refresh_daily_summary(db, days):
+    """Пересчитывает итоги daily_summary для дней [(user_id, log_date), ...] в текущей транзакции."""
+    days = list(set(days))
+    if not days:
+        return
+    await db.executemany("DELETE FROM daily_summary WHERE user_id = ? AND log_date = ?", days)
+    for table in ("daily_logs", "all_daily_logs"):
+        part = [day for day in days if _logs_table(day[1]) == table]
+        if not part:
+            continue
+        await db.executemany(f"""
+            INSERT INTO daily_summary (user_id, log_date, kcal_total, meal_count, item_count)
+            SELECT user_id, log_date, SUM(kcal_total), COUNT(DISTINCT meal_id), COUNT(*)
+            FROM {table}
+            WHERE user_id = ? AND log_date = ?
+            GROUP BY user_id, log_date
+        """, part)
+
+async def _log_days(db, where, params):
+    """Дни (user_id, log_date) записей, подходящих под условие."""
+    async with db.execute(f"SELECT DISTINCT user_id, log_date FROM daily_logs WHERE {where}", params) as cursor:
+        return [tuple(row) for row in await cursor.fetchall()]
+
+def _local_date_str(epoch):
+    return from_epoch(epoch).strftime("%Y-%m-%d")
+
+async def add_log(user_id, meal_id, product_name, weight, kcal, timestamp=None, product_id=None, kcal_source="manual"):
+    """kcal_source — откуда калорийность: 'catalog' (тогда нужен product_id), 'manual' или 'ai'."""
+    async with pool.writer() as db:
+        now = to_epoch(timestamp if timestamp else datetime.datetime.now(USER_TZ))
+        log_date = _local_date_str(now)
+        await _ensure_user(db, user_id)
         await db.execute("""
-            INSERT INTO daily_logs (user_id, meal_id, product_name, weight_g, kcal_total, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user_id, meal_id, product_name, weight, kcal, now))
-        await db.commit()
+            INSERT INTO daily_logs (user_id, meal_id, product_name, weight_g, kcal_total, timestamp, log_date, product_id, kcal_source)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, meal_id, product_name, weight, kcal, now, log_date, product_id, kcal_source))
+        await _refresh_daily_summary(db, [(user_id, log_date)])
 
 async def get_daily_logs(user_id, date: datetime.date):
     date_str = date.strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT id, meal_id, timestamp, product_name, weight_g, kcal_total 
-            FROM daily_logs 
-            WHERE user_id = ? AND substr(timestamp, 1, 10) = ?
+    async with pool.reader() as db:
+        async with db.execute(f"""
+            SELECT {LogRow.COLUMNS}
+            FROM {_logs_table(date_str)}
+            WHERE user_id = ? AND log_date = ?
             ORDER BY timestamp ASC
         """, (user_id, date_str)) as cursor:
+            return [LogRow(*row) for row in await cursor.fetchall()]
+
+async def get_logs_range(user_id, start: datetime.date, end: datetime.date):
+    """
+    Записи пользователя за период [start, end] одним запросом по индексу (user_id, log_date),
+    вместе с архивом, если период до него дотягивается.
+    Асинхронный генератор: отдает (date, [LogRow]) по дням, без загрузки всего периода в память.
+    """
+    day = None
+    rows = []
+    start_str = start.strftime("%Y-%m-%d")
+    async with pool.reader() as db:
+        async with db.execute(f"""
+            SELECT {LogRow.COLUMNS}
+            FROM {_logs_table(start_str)}
+            WHERE user_id = ? AND log_date BETWEEN ? AND ?
+            ORDER BY log_date, timestamp ASC
+        """, (user_id, start_str, end.strftime("%Y-%m-%d"))) as cursor:
+            async for row in cursor:
+                log = LogRow(*row)
+                if log.log_date != day:
+                    if rows:
+                        yield day, rows
+                    day = log.log_date
+                    rows = []
+                rows.append(log)
+    if rows:
+        yield day, rows
+
+async def get_daily_totals(user_id, start: datetime.date, end: datetime.date):
+    """Итоги по дням из daily_summary: [(log_date, kcal_total, meal_count, item_count), ...]."""
+    async with pool.reader() as db:
+        async with db.execute("""
+            SELECT log_date, kcal_total, meal_count, item_count FROM daily_summary
+            WHERE user_id = ? AND log_date BETWEEN ? AND ?
+            ORDER BY log_date
+        """, (user_id, start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))) as cursor:
             return await cursor.fetchall()
 
+async def verify_daily_summary(rebuild=False):
+    """
+    Сверяет daily_summary с исходными записями. Возвращает число расхождений.
+    rebuild=True — при расхождениях пересобирает таблицу целиком (в той же транзакции).
+    """
+    expected = """
+        SELECT user_id, log_date, ROUND(SUM(kcal_total), 3), COUNT(DISTINCT meal_id), COUNT(*)
+        FROM all_daily_logs GROUP BY user_id, log_date
+    """
+    actual = "SELECT user_id, log_date, ROUND(kcal_total, 3), meal_count, item_count FROM daily_summary"
+    # Расхождения в обе стороны: дни, которых нет в итогах, и итоги, которые не сходятся или лишние
+    diff_sql = f"""
+        SELECT COUNT(*) FROM (
+            SELECT * FROM ({expected} EXCEPT {actual})
+            UNION ALL
+            SELECT * FROM ({actual} EXCEPT {expected})
+        )
+    """
+    if not rebuild:
+        async with pool.reader() as db:
+            async with db.execute(diff_sql) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async with pool.writer() as db:
+        async with db.execute(diff_sql) as cursor:
+            mismatched = (await cursor.fetchone())[0]
+        if mismatched:
+            await db.execute("DELETE FROM daily_summary")
+            await db.execute("""
+                INSERT INTO daily_summary (user_id, log_date, kcal_total, meal_count, item_count)
+                SELECT user_id, log_date, SUM(kcal_total), COUNT(DISTINCT meal_id), COUNT(*)
+                FROM all_daily_logs GROUP BY user_id, log_date
+            """)
+    return mismatched
+
+async def get_logs_for_date(date: datetime.date):
+    """Записи всех пользователей за дату одним запросом: {user_id: [LogRow]}."""
+    date_str = date.strftime("%Y-%m-%d")
+    logs = {}
+    async with pool.reader() as db:
+        async with db.execute(f"""
+            SELECT user_id, {LogRow.COLUMNS}
+            FROM {_logs_table(date_str)}
+            WHERE log_date = ?
+            ORDER BY user_id, timestamp ASC
+        """, (date_str,)) as cursor:
+            async for row in cursor:
+                logs.setdefault(row[0], []).append(LogRow(*row[1:]))
+    return logs
+
 async def get_all_products():
-     async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         async with db.execute("SELECT name, kcal_per_100g FROM products ORDER BY name") as cursor:
             return await cursor.fetchall()
 
 async def delete_daily_logs(user_id, date: datetime.date):
     date_str = date.strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DB_PATH) as db:
+    day_start, day_end = day_bounds(date)
+    async with pool.writer() as db:
         await db.execute("""
             DELETE FROM daily_logs 
-            WHERE user_id = ? AND substr(timestamp, 1, 10) = ?
+            WHERE user_id = ? AND log_date = ?
         """, (user_id, date_str))
         
+        # Диапазон времени, чтобы работал индекс (user_id, created_at)
         await db.execute("""
             DELETE FROM meals 
-            WHERE user_id = ? AND substr(created_at, 1, 10) = ?
-        """, (user_id, date_str))
-        
-        await db.commit()
+            WHERE user_id = ? AND created_at >= ? AND created_at < ?
+        """, (user_id, day_start, day_end))
+        await _refresh_daily_summary(db, [(user_id, date_str)])
 
 async def delete_product(name):
     name_clean = name.lower().strip()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("DELETE FROM products WHERE name = ?", (name_clean,))
-        await db.commit()
+    catalog.remove(name_clean)
     
     # Sync to JSON
     await sync_product_to_json(name_clean, action="delete")
 
+async def _delete_meals_at_timestamps(db, user_id, timestamps):
+    """
+    Удаляет приемы пищи (и их логи) пользователя, созданные ровно в указанные моменты.
+    Возвращает (количество приемов, дни (user_id, log_date) удаленных записей).
+    """
+    # 1. Находим meal_id за это время
+    placeholders = ",".join(["?"] * len(timestamps))
+    epochs = [to_epoch(ts) for ts in timestamps]
+    async with db.execute(f"SELECT id FROM meals WHERE user_id = ? AND created_at IN ({placeholders})", (user_id, *epochs)) as cursor:
+        rows = await cursor.fetchall()
+        meal_ids = [r[0] for r in rows]
+    
+    days = []
+    if meal_ids:
+        # 2. Удаляем логи
+        placeholders = ",".join(["?"] * len(meal_ids))
+        days = await _log_days(db, f"meal_id IN ({placeholders})", meal_ids)
+        await db.execute(f"DELETE FROM daily_logs WHERE meal_id IN ({placeholders})", meal_ids)
+        # 3. Удаляем сами приемы пищи
+        await db.execute(f"DELETE FROM meals WHERE id IN ({placeholders})", meal_ids)
+
+    # Перезапись дня, который уже перенесен в архив
+    if pool.archive_horizon and min(_local_date_str(ts) for ts in epochs) < pool.archive_horizon:
+        placeholders = ",".join(["?"] * len(epochs))
+        async with db.execute(f"SELECT id FROM archive.meals WHERE user_id = ? AND created_at IN ({placeholders})", (user_id, *epochs)) as cursor:
+            archived_ids = [r[0] for r in await cursor.fetchall()]
+        if archived_ids:
+            placeholders = ",".join(["?"] * len(archived_ids))
+            async with db.execute(f"SELECT DISTINCT user_id, log_date FROM archive.daily_logs WHERE meal_id IN ({placeholders})", archived_ids) as cursor:
+                days += [tuple(row) for row in await cursor.fetchall()]
+            await db.execute(f"DELETE FROM archive.daily_logs WHERE meal_id IN ({placeholders})", archived_ids)
+            await db.execute(f"DELETE FROM archive.meals WHERE id IN ({placeholders})", archived_ids)
+            meal_ids += archived_ids
+    return len(meal_ids), days
+
 async def delete_meal_at_timestamp(user_id, timestamp):
     """Удаляет существующие записи за конкретный момент времени для перезаписи."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 1. Находим meal_id за это время
-        async with db.execute("SELECT id FROM meals WHERE user_id = ? AND created_at = ?", (user_id, timestamp)) as cursor:
-            rows = await cursor.fetchall()
-            meal_ids = [r[0] for r in rows]
-        
-        if meal_ids:
-            # 2. Удаляем логи
-            placeholders = ",".join(["?"] * len(meal_ids))
-            await db.execute(f"DELETE FROM daily_logs WHERE meal_id IN ({placeholders})", meal_ids)
-            # 3. Удаляем сами приемы пищи
-            await db.execute(f"DELETE FROM meals WHERE id IN ({placeholders})", meal_ids)
-            await db.commit()
-            logging.info(f"Overwriting: Deleted {len(meal_ids)} older meals at {timestamp}")
+    async with pool.writer() as db:
+        deleted, days = await _delete_meals_at_timestamps(db, user_id, [timestamp])
+        await _refresh_daily_summary(db, days)
+    if deleted:
+        logging.info(f"Overwriting: Deleted {deleted} older meals at {timestamp}")
+
+async def write_meal_batch(user_id, groups):
+    """
+    Записывает разобранное сообщение одной транзакцией (всё или ничего).
+    groups: список dict:
+        meal_id   - id приема пищи
+        timestamp - datetime приема пищи
+        create    - True: создать прием, False: дописать в существующий (обновить updated_at)
+        overwrite - True: сначала удалить приемы пищи за этот же момент (перезапись истории)
+        items     - список (product_name, weight, kcal_total, product_id, kcal_source)
+                    product_id  - id продукта справочника, если калорийность взята из него, иначе None
+                    kcal_source - 'catalog' (справочник), 'manual' (введена пользователем) или 'ai' (оценка ИИ)
+    Возвращает множество затронутых дат.
+    """
+    now = to_epoch(datetime.datetime.now(USER_TZ))
+    overwrite_ts = [g["timestamp"] for g in groups if g["overwrite"]]
+    epochs = [to_epoch(g["timestamp"]) for g in groups]
+    new_meals = [(g["meal_id"], user_id, None, ts, ts) for g, ts in zip(groups, epochs) if g["create"]]
+    touched_meals = [(now, g["meal_id"]) for g in groups if not g["create"]]
+    logs = [
+        (user_id, g["meal_id"], name, weight, kcal, ts, _local_date_str(ts), product_id, kcal_source)
+        for g, ts in zip(groups, epochs)
+        for name, weight, kcal, product_id, kcal_source in g["items"]
+    ]
+
+    async with pool.writer() as db:
+        # Пользователь мог не вызывать /start (например, база пересоздана после деплоя)
+        await _ensure_user(db, user_id)
+        deleted, days = await _delete_meals_at_timestamps(db, user_id, overwrite_ts) if overwrite_ts else (0, [])
+        if new_meals:
+            await db.executemany("INSERT INTO meals (id, user_id, last_report_message_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)", new_meals)
+        if touched_meals:
+            await db.executemany("UPDATE meals SET updated_at = ? WHERE id = ?", touched_meals)
+        if logs:
+            await db.executemany("""
+                INSERT INTO daily_logs (user_id, meal_id, product_name, weight_g, kcal_total, timestamp, log_date, product_id, kcal_source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, logs)
+        await _refresh_daily_summary(db, days + [(user_id, log[6]) for log in logs])
+
+    if deleted:
+        logging.info(f"Overwriting: Deleted {deleted} older meals")
+    return {from_epoch(ts).date() for ts in epochs}
 
 async def get_log_entry(log_id):
     """Получает одну запись из логов по ID."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT id, product_name, weight_g, kcal_total, meal_id FROM daily_logs WHERE id = ?", (log_id,)) as cursor:
-            return await cursor.fetchone()
+    async with pool.reader() as db:
+        async with db.execute(f"SELECT {LogRow.COLUMNS} FROM daily_logs WHERE id = ?", (log_id,)) as cursor:
+            row = await cursor.fetchone()
+            return LogRow(*row) if row else None
 
 async def update_log_entry(log_id, weight=None, kcal=None):
-    """Обновляет вес или калории конкретной записи."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    """
+    Обновляет вес или калории конкретной записи.
+    Вес с калориями — пропорциональный пересчет, источник калорийности сохраняется.
+    Калории, введенные вручную (без веса), делают запись ручной и отвязывают ее от справочника —
+    пересчет и связывание их не перезапишут.
+    """
+    async with pool.writer() as db:
+        days = await _log_days(db, "id = ?", (log_id,))
         if weight is not None and kcal is not None:
             await db.execute("UPDATE daily_logs SET weight_g = ?, kcal_total = ? WHERE id = ?", (weight, kcal, log_id))
         elif weight is not None:
             await db.execute("UPDATE daily_logs SET weight_g = ? WHERE id = ?", (weight, log_id))
         elif kcal is not None:
-            await db.execute("UPDATE daily_logs SET kcal_total = ? WHERE id = ?", (kcal, log_id))
-        await db.commit()
+            await db.execute("UPDATE daily_logs SET kcal_total = ?, product_id = NULL, kcal_source = 'manual' WHERE id = ?", (kcal, log_id))
+        await _refresh_daily_summary(db, days)
+
+async def recalculate_product_logs(product_id, since: datetime.date = None, user_id=None):
+    """
+    Пересчитывает kcal_total записей продукта по текущей калорийности справочника
+    одним UPDATE по индексу (product_id, log_date). since — с какой даты (None — вся история),
+    user_id — только записи пользователя (None — всех). Записи без веса и с калорийностью
+    не из справочника (введенной вручную, оценкой ИИ) не трогаются.
+    Возвращает количество измененных записей.
+    """
+    where = "product_id = ? AND log_date >= ? AND kcal_source = 'catalog' AND weight_g > 0"
+    params = [product_id, since.strftime("%Y-%m-%d") if since else ""]
+    if user_id is not None:
+        where += " AND user_id = ?"
+        params.append(user_id)
+    new_kcal = "weight_g * (SELECT kcal_per_100g FROM products WHERE id = daily_logs.product_id) / 100.0"
+    # Только записи, у которых значение действительно меняется
+    where += f" AND abs(kcal_total - {new_kcal}) > 0.001"
+
+    # Архивные записи пересчитываются, только если период до них дотягивается
+    tables = ["main.daily_logs"]
+    if _logs_table(params[1]) == "all_daily_logs":
+        tables.append("archive.daily_logs")
+
+    async with pool.writer() as db:
+        days = []
+        before = db.total_changes
+        for table in tables:
+            async with db.execute(f"SELECT DISTINCT user_id, log_date FROM {table} WHERE {where}", params) as cursor:
+                days += [tuple(row) for row in await cursor.fetchall()]
+            await db.execute(f"UPDATE {table} SET kcal_total = {new_kcal} WHERE {where}", params)
+        changed = db.total_changes - before
+        await _refresh_daily_summary(db, days)
+    logging.info(f"Recalculated {changed} logs of product {product_id} since {since or 'the beginning'}")
+    return changed
+
+async def archive_logs_before(cutoff: datetime.date, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Переносит записи с log_date раньше cutoff в архив, затем приемы пищи до cutoff, у которых
+    в основной базе не осталось записей. daily_summary не меняется: итоги по дням остаются в основной базе.
+
+    В режиме WAL транзакция по двум файлам не атомарна, поэтому каждая пачка — две транзакции:
+    копия в архив, затем удаление из основной базы. Сбой между ними дает лишь дубль,
+    который уберет следующий запуск, но не потерю записей.
+    Возвращает (перенесено записей, перенесено приемов пищи).
+    """
+    cutoff_str = cutoff.strftime("%Y-%m-%d")
+    # Граница двигается до переноса: чтения начинают учитывать архив раньше, чем в нем появятся записи
+    if not pool.archive_horizon or cutoff_str > pool.archive_horizon:
+        await set_job_state(ARCHIVE_HORIZON_STATE, cutoff_str)
+        pool.archive_horizon = cutoff_str
+
+    batches = (
+        ("daily_logs", LOG_COLUMNS, "SELECT id FROM main.daily_logs WHERE log_date < ? LIMIT ?", cutoff_str),
+        ("meals", MEAL_COLUMNS, """
+            SELECT id FROM main.meals AS m
+            WHERE created_at < ? AND NOT EXISTS (SELECT 1 FROM main.daily_logs AS l WHERE l.meal_id = m.id)
+            LIMIT ?
+        """, day_bounds(cutoff)[0]),
+    )
+    moved = []
+    for table, columns, select_ids, bound in batches:
+        count = 0
+        while True:
+            async with pool.reader() as db:
+                async with db.execute(select_ids, (bound, batch_size)) as cursor:
+                    ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                break
+            placeholders = ",".join(["?"] * len(ids))
+            async with pool.writer() as db:
+                await db.execute(f"""
+                    INSERT OR REPLACE INTO archive.{table} ({columns})
+                    SELECT {columns} FROM main.{table} WHERE id IN ({placeholders})
+                """, ids)
+            async with pool.writer() as db:
+                await db.execute(f"""
+                    DELETE FROM main.{table} WHERE id IN ({placeholders})
+                    AND EXISTS (SELECT 1 FROM archive.{table} AS a WHERE a.id = main.{table}.id)
+                """, ids)
+            count += len(ids)
+        moved.append(count)
+    return tuple(moved)
 
 async def delete_log_entry(log_id):
     """Удаляет конкретную запись из логов."""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
+        days = await _log_days(db, "id = ?", (log_id,))
         await db.execute("DELETE FROM daily_logs WHERE id = ?", (log_id,))
-        await db.commit()
+        await _refresh_daily_summary(db, days)
 
 async def get_last_log_date(user_id):
     """Возвращает дату последней добавленной записи (по ID, а не по времени)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT timestamp FROM daily_logs WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)) as cursor:
+    async with pool.reader() as db:
+        async with db.execute("SELECT log_date FROM daily_logs WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)) as cursor:
             row = await cursor.fetchone()
-            if row:
-                # row[0] might be string or datetime object depending on how it was saved
-                # In this project we save as datetime object but aiosqlite might return string
-                ts = row[0]
-                if isinstance(ts, str):
-                   # Handle standard ISO format 'YYYY-MM-DD HH:MM:SS...'
-                   try:
-                       return datetime.datetime.strptime(ts[:10], "%Y-%m-%d").date()
-                   except:
-                       return None
-                elif isinstance(ts, datetime.datetime):
-                    return ts.date()
-            return None
+            return datetime.date.fromisoformat(row[0]) if row else None
+
+async def get_cached_calories(key):
+    """Возвращает (kcal, expires_at) из кэша калорийности или None."""
+    async with pool.reader() as db:
+        async with db.execute("SELECT kcal, expires_at FROM calorie_cache WHERE key = ?", (key,)) as cursor:
+            return await cursor.fetchone()
+
+async def set_cached_calories(key, kcal, expires_at):
+    async with pool.writer() as db:
+        await db.execute("INSERT OR REPLACE INTO calorie_cache (key, kcal, expires_at) VALUES (?, ?, ?)", (key, kcal, expires_at))
+
+async def get_job_state(name):
+    async with pool.reader() as db:
+        async with db.execute("SELECT value FROM job_state WHERE name = ?", (name,)) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+async def set_job_state(name, value):
+    """Сохраняет состояние задачи; value=None удаляет запись."""
+    async with pool.writer() as db:
+        if value is None:
+            await db.execute("DELETE FROM job_state WHERE name = ?", (name,))
+        else:
+            await db.execute(
+                "INSERT OR REPLACE INTO job_state (name, value, updated_at) VALUES (?, ?, ?)",
+                (name, value, datetime.datetime.now(USER_TZ))
+            )
+
+async def get_products_to_verify(checked_before, limit, exclude=()):
+    """
+    Продукты, не проверенные с момента checked_before: сначала никогда не проверенные,
+    затем самые давние. exclude — id, уже пропущенные в этом проходе.
+    Возвращает [(id, name, kcal_per_100g), ...].
+    """
+    exclude = list(exclude)
+    not_excluded = f"AND id NOT IN ({','.join(['?'] * len(exclude))})" if exclude else ""
+    async with pool.reader() as db:
+        async with db.execute(f"""
+            SELECT id, name, kcal_per_100g FROM products
+            WHERE (last_verified IS NULL OR last_verified < ?) {not_excluded}
+            ORDER BY last_verified IS NOT NULL, last_verified, id
+            LIMIT ?
+        """, (checked_before, *exclude, limit)) as cursor:
+            return await cursor.fetchall()
+
+async def save_verification_batch(product_ids, reviews):
+    """
+    Отмечает продукты проверенными и записывает расхождения одной транзакцией.
+    reviews: список (product_id, name, current_kcal, suggested_kcal).
+    """
+    now = datetime.datetime.now(USER_TZ)
+    async with pool.writer() as db:
+        await db.executemany("UPDATE products SET last_verified = ? WHERE id = ?", [(now, pid) for pid in product_ids])
+        await db.executemany("""
+            INSERT OR REPLACE INTO product_review (product_id, name, current_kcal, suggested_kcal, found_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(pid, name, current, suggested, now) for pid, name, current, suggested in reviews])
+
+async def enqueue_sync(entries):
+    """
+    Ставит отчеты в очередь отправки в Google Docs. entries: список (user_id, date, doc_id, report_text).
+    Уже поставленный или доставленный текст повторно не добавляется; исчерпавший попытки — возвращается в очередь.
+    Возвращает количество поставленных в очередь отчетов.
+    """
+    now = datetime.datetime.now(USER_TZ)
+    rows = [
+        (user_id, date.strftime("%Y-%m-%d"), doc_id, hashlib.sha256(text.encode("utf-8")).hexdigest(), text, time.time(), now)
+        for user_id, date, doc_id, text in entries
+    ]
+    async with pool.writer() as db:
+        before = db.total_changes
+        await db.executemany("""
+            INSERT INTO sync_outbox (user_id, log_date, doc_id, content_hash, report_text, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(doc_id, user_id, log_date, content_hash) DO UPDATE
+            SET status = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at, last_error = NULL
+            WHERE status = 'failed'
+        """, rows)
+        return db.total_changes - before
+
+async def get_due_sync_entries(now, limit):
+    """Отчеты, которые пора отправить: [(id, doc_id, report_text, attempts), ...] в порядке постановки."""
+    async with pool.reader() as db:
+        async with db.execute("""
+            SELECT id, doc_id, report_text, attempts FROM sync_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        """, (now, limit)) as cursor:
+            return await cursor.fetchall()
+
+async def finish_sync_entries(delivered_ids, retries):
+    """
+    Результат отправки одной транзакцией.
+    retries: список (id, attempts, next_attempt_at, error, status) для неудачных отправок.
+    """
+    now = datetime.datetime.now(USER_TZ)
+    async with pool.writer() as db:
+        await db.executemany(
+            "UPDATE sync_outbox SET status = 'delivered', delivered_at = ?, last_error = NULL WHERE id = ?",
+            [(now, entry_id) for entry_id in delivered_ids]
+        )
+        await db.executemany(
+            "UPDATE sync_outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, status = ? WHERE id = ?",
+            [(attempts, next_at, error, status, entry_id) for entry_id, attempts, next_at, error, status in retries]
+        )
+
+async def get_sync_outbox_stats():
+    async with pool.reader() as db:
+        async with db.execute("SELECT status, COUNT(*) FROM sync_outbox GROUP BY status") as cursor:
+            return dict(await cursor.fetchall())
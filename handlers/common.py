@@ -1,6 +1,7 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramBadRequest
 import re
 from database import repository
 
@@ -23,9 +24,14 @@ async def cmd_help(message: types.Message):
         "/database - Показать базу продуктов\n"
         "/clear - Сбросить все записи за сегодня\n"
         "/edit - Редактировать приемы пищи за сегодня\n"
-        "/sync - Синхронизировать с Google Docs сейчас\n"
+        "/week - Статистика за 7 дней\n"
+        "/month - Статистика за 30 дней\n"
+        "/sync - Синхронизировать с Google Docs сейчас (можно период: /sync 01.01.26-31.01.26)\n"
         "/add Название Калории - Добавить новый продукт\n"
-        "/del Название - Удалить продукт из базы\n\n"
+        "/del Название - Удалить продукт из базы\n"
+        "/recalc Название [дата] - Пересчитать прошлые записи продукта по калорийности из базы\n"
+        "/llmstats - Статистика кэшей ИИ\n"
+        "/checksummary - Сверить итоги по дням с записями (/checksummary fix — пересобрать)\n\n"
         "Просто отправь текст с едой, чтобы добавить прием пищи."
     )
 
@@ -136,7 +142,11 @@ async def cmd_del(message: types.Message):
 async def handle_save_prod(callback: types.CallbackQuery):
     _, name, kcal = callback.data.split(":")
     await repository.add_product(name, int(kcal), is_verified=True)
-    await callback.message.edit_text(f"✅ Продукт **{name}** ({kcal} ккал) добавлен в базу!", parse_mode="Markdown")
+    await callback.message.edit_text(
+        f"✅ Продукт **{name}** ({kcal} ккал) добавлен в базу!\n"
+        f"Пересчитать прошлые записи: /recalc {name}",
+        parse_mode="Markdown"
+    )
     await callback.answer()
 
 @router.callback_query(F.data.startswith("del_prod:"))
@@ -146,6 +156,32 @@ async def handle_del_prod(callback: types.CallbackQuery):
     await callback.message.edit_text(f"🗑 Продукт **{name}** удален из базы.", parse_mode="Markdown")
     await callback.answer()
 
+@router.message(Command("recalc"))
+async def cmd_recalc(message: types.Message):
+    args = message.text.replace("/recalc", "", 1).strip()
+    if not args:
+        await message.answer("Формат: /recalc Название [с даты]\nПример: /recalc Гречка 01.01.26")
+        return
+
+    # Необязательная дата — последним словом
+    name, since = args, None
+    parts = args.rsplit(maxsplit=1)
+    if len(parts) == 2 and parse_sync_date(parts[1]):
+        name, since = parts[0], parse_sync_date(parts[1])
+
+    product = await repository.get_product(name)
+    if not product:
+        await message.answer(f"Продукт '{name}' не найден в базе.")
+        return
+    product_id, real_name, kcal = product[0], product[1], product[2]
+
+    changed = await repository.recalculate_product_logs(product_id, since, user_id=message.from_user.id)
+    period = f" с {since.strftime('%d.%m.%y')}" if since else ""
+    if changed:
+        await message.answer(f"🔄 {real_name} ({kcal} ккал): пересчитано записей{period} — {changed}.")
+    else:
+        await message.answer(f"ℹ️ {real_name} ({kcal} ккал): записи{period} уже соответствуют базе.")
+
 @router.callback_query(F.data == "cancel_action")
 async def handle_cancel(callback: types.CallbackQuery):
     await callback.message.edit_text("Действие отменено.")
@@ -157,39 +193,93 @@ async def cmd_clear(message: types.Message):
     from config import USER_TZ
     await repository.delete_daily_logs(message.from_user.id, datetime.now(USER_TZ).date())
     await message.answer("🧹 Все записи за сегодня удалены из дневника.")
+
+
+SYNC_DATE_FORMATS = ["%d.%m.%y", "%d/%m/%y", "%Y-%m-%d", "%d.%m.%Y"]
+SYNC_MAX_DAYS = 366
+
+def parse_sync_date(value):
+    from datetime import datetime
+    for fmt in SYNC_DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_sync_range(args):
+    """'25.01.26' или '01.01.26-31.01.26' -> (начало, конец) или None."""
+    single = parse_sync_date(args)
+    if single:
+        return single, single
+    # Разделитель ищем перебором, т.к. '-' встречается и внутри дат формата YYYY-MM-DD
+    for i, ch in enumerate(args):
+        if ch in "-–—":
+            start, end = parse_sync_date(args[:i]), parse_sync_date(args[i + 1:])
+            if start and end:
+                return (start, end) if start <= end else (end, start)
+    return None
+
 @router.message(Command("sync"))
 async def cmd_sync(message: types.Message):
-    from utils.scheduler import sync_user_day
+    from utils.scheduler import sync_user_day, sync_user_range
     from config import USER_TZ
     from datetime import datetime
     import os
+    import time
     
     doc_id = os.getenv("GOOGLE_DOC_ID")
     if not doc_id:
         await message.answer("❌ GOOGLE_DOC_ID не настроен.")
         return
 
-    # 1. Check for explicit date argument /sync DD.MM.YY
+    user_id = message.from_user.id
+
+    # 1. Check for explicit date or range argument: /sync DD.MM.YY or /sync DD.MM.YY-DD.MM.YY
     args = message.text.replace("/sync", "").strip()
-    target_date = None
     
     if args:
-        try:
-            # Try parsing various formats
-            for fmt in ["%d.%m.%y", "%d/%m/%y", "%Y-%m-%d", "%d.%m.%Y"]:
+        date_range = parse_sync_range(args)
+        if not date_range:
+            await message.answer("⚠️ Неверный формат даты. Используйте: /sync 25.01.26 или /sync 01.01.26-31.01.26")
+            return
+        start_date, end_date = date_range
+        if (end_date - start_date).days >= SYNC_MAX_DAYS:
+            await message.answer(f"⚠️ Слишком длинный период (максимум {SYNC_MAX_DAYS} дней).")
+            return
+
+        if start_date != end_date:
+            period = f"{start_date.strftime('%d.%m.%y')}–{end_date.strftime('%d.%m.%y')}"
+            # Одно сообщение с ходом выполнения, редактируется не чаще раза в секунду
+            status = await message.answer(f"🔄 Готовлю отчеты за {period}...")
+            last_edit = time.monotonic()
+
+            async def progress(day, done, total):
+                nonlocal last_edit
+                if time.monotonic() - last_edit < 1:
+                    return
+                last_edit = time.monotonic()
                 try:
-                    target_date = datetime.strptime(args, fmt).date()
-                    break
-                except ValueError:
-                    continue
-            if not target_date:
-                raise ValueError("Format unknown")
-        except:
-             await message.answer("⚠️ Неверный формат даты. Используйте: /sync 25.01.26")
-             return
+                    await status.edit_text(f"🔄 Готовлю отчеты за {period}: {done}/{total} дней...")
+                except TelegramBadRequest:
+                    pass
+
+            try:
+                days, queued = await sync_user_range(user_id, start_date, end_date, doc_id, progress=progress)
+            except Exception as e:
+                await status.edit_text(f"❌ Ошибка: {e}")
+                return
+            if not days:
+                text = f"⚠️ Нет данных для синхронизации за {period}."
+            else:
+                text = f"✅ {period}: дней с записями — {days}, поставлено в очередь — {queued}."
+                if queued < days:
+                    text += f"\nℹ️ {days - queued} отчетов уже отправлены или ждут отправки."
+            await status.edit_text(text)
+            return
+        target_date = start_date
     else:
         # 2. Check last added log date
-        user_id = message.from_user.id
         last_log_date = await repository.get_last_log_date(user_id)
         
         # If user has logs, use last log date. If no logs, default to today.
@@ -198,13 +288,113 @@ async def cmd_sync(message: types.Message):
         else:
             target_date = datetime.now(USER_TZ).date()
 
-    await message.answer(f"🔄 Синхронизирую данные за {target_date.strftime('%d.%m.%y')}...")
-    
     try:
-        success = await sync_user_day(message.from_user.id, target_date, doc_id)
-        if success:
-            await message.answer(f"✅ Данные за {target_date.strftime('%d.%m.%y')} успешно добавлены!")
+        queued = await sync_user_day(user_id, target_date, doc_id)
+        if queued:
+            await message.answer(f"✅ Отчет за {target_date.strftime('%d.%m.%y')} поставлен в очередь и скоро появится в документе.")
+        elif queued is None:
+            await message.answer(f"⚠️ Нет данных для синхронизации за {target_date.strftime('%d.%m.%y')}.")
         else:
-            await message.answer(f"⚠️ Нет данных для синхронизации за {target_date.strftime('%d.%m.%y')} или произошла ошибка.")
+            await message.answer(f"ℹ️ Этот отчет за {target_date.strftime('%d.%m.%y')} уже отправлен или ждет отправки.")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
+
+async def send_period_stats(message: types.Message, days, title, show_days):
+    from services.stats import period_stats, format_stats
+    from config import USER_TZ
+    from datetime import datetime, timedelta
+    import logging
+
+    end = datetime.now(USER_TZ).date()
+    start = end - timedelta(days=days - 1)
+    stats, elapsed_ms = await period_stats(message.from_user.id, start, end)
+    logging.info(f"{title}: {stats['items']} logs for user {message.from_user.id} in {elapsed_ms:.1f} ms")
+    await message.answer(format_stats(title, stats, show_days=show_days))
+
+@router.message(Command("week"))
+async def cmd_week(message: types.Message):
+    await send_period_stats(message, 7, "📈 Неделя", show_days=True)
+
+@router.message(Command("month"))
+async def cmd_month(message: types.Message):
+    await send_period_stats(message, 30, "📈 Месяц", show_days=False)
+
+@router.message(Command("checksummary"))
+async def cmd_check_summary(message: types.Message):
+    rebuild = "fix" in message.text.replace("/checksummary", "").lower()
+    mismatched = await repository.verify_daily_summary(rebuild=rebuild)
+    if not mismatched:
+        await message.answer("✅ Итоги по дням совпадают с записями.")
+    elif rebuild:
+        await message.answer(f"🔧 Найдено расхождений: {mismatched}. Итоги пересобраны из записей.")
+    else:
+        await message.answer(f"⚠️ Найдено расхождений: {mismatched}. Пересобрать: /checksummary fix")
+
+@router.message(Command("llmstats"))
+async def cmd_llm_stats(message: types.Message):
+    from services.calorie_cache import calorie_cache
+    from services.parse_cache import parse_cache
+    from services.local_parser import local_parser
+    from services.singleflight import singleflight
+    from services.groq_ai import llm, parse_timings
+    
+    kcal_stats = calorie_cache.stats()
+    parse_stats = parse_cache.stats()
+    fast_stats = local_parser.stats()
+    flight_stats = singleflight.stats()
+    hedge_stats = llm.stats()
+    timings = {name: hist.summary() for name, hist in parse_timings.items()}
+
+    def fmt_timing(name):
+        t = timings[name]
+        if not t["count"]:
+            return "нет данных"
+        return f"p50 {t['p50']}с, p95 {t['p95']}с (n={t['count']})"
+
+    kind_names = {
+        "parse": "разбор",
+        "parse_stream": "разбор, первый фрагмент потока",
+        "lookup": "калорийность",
+        "lookup_batch": "калорийность списком",
+    }
+    hedge_delays = ", ".join(
+        f"{kind_names.get(kind, kind)} {delay}с" for kind, delay in hedge_stats["hedge_delay"].items()
+    ) or "нет замеров"
+
+    provider_lines = ""
+    for name, p in hedge_stats["providers"].items():
+        latency = "".join(
+            f"  {kind_names.get(kind, kind)}: p50 {t['p50']}с, p95 {t['p95']}с (n={t['count']}, оборвано: {t['censored']})\n"
+            for kind, t in p["latency"].items() if t["count"]
+        ) or "  нет замеров\n"
+        provider_lines += (
+            f"🚦 {name}:\n{latency}"
+            f"Очередь: {p['queue_depth']}, выполняется: {p['active']}, circuit breaker: {p['circuit']}\n"
+            f"Повторов: {p['retries']}, ограничений (429/бюджет): {p['throttled']}, отклонено: {p['rejected']}\n"
+            f"Остаток лимита: {p['remaining_requests']} запросов, {p['remaining_tokens']} токенов\n"
+        )
+
+    await message.answer(
+        "📊 Кэш калорийности:\n"
+        f"Попаданий: {kcal_stats['hits']} (из БД: {kcal_stats['db_hits']}, негативных: {kcal_stats['negative_hits']})\n"
+        f"Промахов: {kcal_stats['misses']}\n"
+        f"Hit rate: {kcal_stats['hit_rate']:.0%}\n"
+        f"Записей в памяти: {kcal_stats['size']}\n\n"
+        "📝 Кэш разборов:\n"
+        f"Попаданий: {parse_stats['hits']}, промахов: {parse_stats['misses']}\n"
+        f"Hit rate: {parse_stats['hit_rate']:.0%}\n"
+        f"Записей: {parse_stats['size']}\n\n"
+        "⚡ Локальный разбор (без ИИ):\n"
+        f"Разобрано: {fast_stats['hits']}, передано ИИ: {fast_stats['fallbacks']}\n"
+        f"Доля: {fast_stats['hit_ratio']:.0%}\n\n"
+        "🔗 Объединение одинаковых запросов:\n"
+        f"Запросов к ИИ: {flight_stats['calls']}, сэкономлено: {flight_stats['saved']}\n\n"
+        "🛡 Hedging провайдеров:\n"
+        f"Задержка до дубля: {hedge_delays}\n"
+        f"Дублировано: {hedge_stats['hedged']}, ответ резерва быстрее: {hedge_stats['hedge_wins']}, переключений при отказе: {hedge_stats['failovers']}\n\n"
+        f"{provider_lines}\n"
+        "⏱ Время разбора:\n"
+        f"Без стриминга: {fmt_timing('blocking_total')}\n"
+        f"Стриминг, первый продукт: {fmt_timing('stream_first_item')}\n"
+        f"Стриминг, весь ответ: {fmt_timing('stream_total')}"
+    )
@@ -5,6 +5,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from database import repository
 from services import report
+from utils.live_report import show_day_report
 from datetime import datetime
 from config import USER_TZ
 import re
@@ -32,17 +33,10 @@ async def cmd_edit(message: types.Message, state: FSMContext):
 
     # Группируем по meal_id
     meals = {}
-    for log_id, meal_id, ts, name, weight, kcal in logs:
-        if isinstance(ts, str):
-            # Парсим строку времени
-            match = re.search(r"(\d{2}:\d{2})", ts)
-            t_str = match.group(1) if match else "??:??"
-        else:
-            t_str = ts.strftime("%H:%M")
-            
-        if meal_id not in meals:
-            meals[meal_id] = {"time": t_str, "count": 0}
-        meals[meal_id]["count"] += 1
+    for log in logs:
+        if log.meal_id not in meals:
+            meals[log.meal_id] = {"time": log.timestamp.strftime("%H:%M"), "count": 0}
+        meals[log.meal_id]["count"] += 1
 
     keyboard = []
     # Сортируем по времени
@@ -69,18 +63,18 @@ async def handle_meal_edit(callback: types.CallbackQuery, state: FSMContext):
     logs = await repository.get_daily_logs(user_id, now.date())
     
     # Фильтруем только нужный прием пищи
-    items = [log for log in logs if log[1] == meal_id]
+    items = [log for log in logs if log.meal_id == meal_id]
     
     if not items:
         await callback.answer("Прием пищи не найден.")
         return
 
     keyboard = []
-    for log_id, m_id, ts, name, weight, kcal in items:
-        w_text = f" ({int(weight)}г)" if weight > 0 else ""
+    for log in items:
+        w_text = f" ({int(log.weight_g)}г)" if log.weight_g > 0 else ""
         keyboard.append([InlineKeyboardButton(
-            text=f"🍴 {name.capitalize()}{w_text} - {int(kcal)} ккал",
-            callback_data=f"edit_item:{log_id}"
+            text=f"🍴 {log.product_name.capitalize()}{w_text} - {int(log.kcal_total)} ккал",
+            callback_data=f"edit_item:{log.id}"
         )])
     
     keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="edit_back_to_meals")])
@@ -105,9 +99,7 @@ async def handle_item_edit_menu(callback: types.CallbackQuery, state: FSMContext
         await callback.answer("Запись не найдена.")
         return
     
-    _, name, weight, kcal, meal_id = item
-    
-    text = f"Редактирование: **{name}**\nТекущие данные: {int(weight)}г, {int(kcal)} ккал."
+    text = f"Редактирование: **{item.product_name}**\nТекущие данные: {int(item.weight_g)}г, {int(item.kcal_total)} ккал."
     
     keyboard = [
         [
@@ -115,7 +107,7 @@ async def handle_item_edit_menu(callback: types.CallbackQuery, state: FSMContext
             InlineKeyboardButton(text="🔥 Калории", callback_data=f"action:kcal:{log_id}")
         ],
         [InlineKeyboardButton(text="🗑 Удалить", callback_data=f"action:delete:{log_id}")],
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"edit_meal:{meal_id}")]
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data=f"edit_meal:{item.meal_id}")]
     ]
     
     await callback.message.edit_text(
@@ -138,6 +130,8 @@ async def handle_action(callback: types.CallbackQuery, state: FSMContext):
         logs = await repository.get_daily_logs(callback.from_user.id, now.date())
         report_text = await report.generate_day_report(logs)
         await callback.message.edit_text(f"✅ Удалено.\n\n{report_text}")
+        # Это сообщение теперь и есть актуальный отчет за день
+        await repository.set_day_report_message_id(callback.from_user.id, now.date(), callback.message.message_id)
         
     elif action == "weight":
         await state.update_data(edit_log_id=log_id)
@@ -164,14 +158,13 @@ async def process_new_weight(message: types.Message, state: FSMContext):
     
     item = await repository.get_log_entry(log_id)
     if item:
-        _, name, old_weight, old_total_kcal, meal_id = item
         # Пропорционально пересчитываем калории
-        if old_weight > 0:
-            kcal_per_1g = old_total_kcal / old_weight
+        if item.weight_g > 0:
+            kcal_per_1g = item.kcal_total / item.weight_g
             new_kcal = kcal_per_1g * new_weight
         else:
             # Если раньше был 0, берем из базы или ставим 0
-            product = await repository.get_product(name)
+            product = await repository.get_product(item.product_name)
             kcal_per_100 = product[2] if product else 0
             new_kcal = (new_weight / 100) * kcal_per_100
             
@@ -180,9 +173,7 @@ async def process_new_weight(message: types.Message, state: FSMContext):
         
         # Показываем отчет
         now = datetime.now(USER_TZ)
-        logs = await repository.get_daily_logs(message.from_user.id, now.date())
-        report_text = await report.generate_day_report(logs)
-        await message.answer(report_text)
+        await show_day_report(message, message.from_user.id, now.date())
     
     await state.clear()
 
@@ -202,8 +193,6 @@ async def process_new_kcal(message: types.Message, state: FSMContext):
     
     # Показываем отчет
     now = datetime.now(USER_TZ)
-    logs = await repository.get_daily_logs(message.from_user.id, now.date())
-    report_text = await report.generate_day_report(logs)
-    await message.answer(report_text)
+    await show_day_report(message, message.from_user.id, now.date())
     
     await state.clear()
@@ -4,8 +4,10 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from database import repository
-from services import groq_ai as ai_service, report
+from services import groq_ai as ai_service
+from utils.live_report import show_day_report
 from config import USER_TZ
+import asyncio
 import uuid
 from datetime import datetime
 import logging
@@ -38,25 +40,14 @@ async def handle_food_text(message: types.Message, state: FSMContext):
     
     should_prompt = False
     if last_meal:
-        meal_id, uid, msg_id, created_at, updated_at = last_meal
-        
-        if isinstance(updated_at, str):
-            try:
-                last_time = datetime.strptime(updated_at.split('.')[0], "%Y-%m-%d %H:%M:%S")
-                last_time = last_time.replace(tzinfo=USER_TZ)
-            except:
-                last_time = datetime.now(USER_TZ)
-        else:
-            last_time = updated_at
-            
         now = datetime.now(USER_TZ)
-        diff = (now - last_time).total_seconds() / 60
+        diff = (now - (last_meal.updated_at or last_meal.created_at)).total_seconds() / 60
         
         if diff < 60:
             should_prompt = True
     
     if should_prompt:
-        await state.update_data(text=text, meal_id=last_meal[0])
+        await state.update_data(text=text, meal_id=last_meal.id)
         await state.set_state(FoodLogState.waiting_for_action)
         
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -89,11 +80,61 @@ async def handle_action(callback: types.CallbackQuery, state: FSMContext):
         await state.clear()
         await unified_process_input(callback.message, text, callback.from_user.id, is_new_meal=is_new, meal_id=actual_meal_id, state=state)
 
+# Сколько неизвестных продуктов набрать во время потокового разбора, чтобы сразу запросить их калорийность
+LOOKUP_BATCH_SIZE = 5
+
+async def parse_with_prefetch(text):
+    """
+    Потоковый разбор текста: калорийность продуктов, которых нет в базе, запрашивается
+    пачками по мере поступления, пока ИИ еще дописывает ответ.
+    Возвращает (parsed_items, {название: ккал на 100г или None}).
+    """
+    parsed_items = []
+    unknown_names = []
+    lookup_batch = []
+    lookups = []
+
+    async def collect(item):
+        nonlocal lookup_batch
+        parsed_items.append(item)
+        name, m_kcal = item[0], item[2]
+        if m_kcal is None and name not in unknown_names and not await repository.get_product(name):
+            unknown_names.append(name)
+            lookup_batch.append(name)
+            if len(lookup_batch) >= LOOKUP_BATCH_SIZE:
+                lookups.append(asyncio.create_task(ai_service.get_calories_info_batch(lookup_batch)))
+                lookup_batch = []
+
+    try:
+        async for item in ai_service.stream_food_input(text):
+            await collect(item)
+    except Exception as e:
+        # Поток оборвался — разбираем заново обычным запросом (уже запущенные поиски переиспользуются)
+        logging.error(f"Streaming parse failed, falling back to full parse: {e}")
+        parsed_items.clear()
+        for item in await ai_service.parse_food_input(text):
+            await collect(item)
+
+    if lookup_batch:
+        lookups.append(asyncio.create_task(ai_service.get_calories_info_batch(lookup_batch)))
+
+    ai_kcal = {}
+    for result in await asyncio.gather(*lookups):
+        ai_kcal.update(result)
+    return parsed_items, ai_kcal
+
 async def unified_process_input(message: types.Message, text: str, user_id: int, is_new_meal: bool, meal_id: str = None, state: FSMContext = None):
     # 1. Parse
-    parsed_items = await ai_service.parse_food_input(text)
+    queue_depth = ai_service.llm.queue_depth
+    if queue_depth > 0:
+        await message.answer(f"⏳ Сейчас много запросов к ИИ (в очереди: {queue_depth}). Ответ может задержаться.")
+
+    parsed_items, ai_kcal = await parse_with_prefetch(text)
     if not parsed_items:
         logging.error(f"Groq returned empty or failed for text: {text}")
+        if ai_service.llm.is_open:
+            await message.answer("⚠️ ИИ временно недоступен. Попробуйте через минуту или укажите калории вручную, например: 'Яблоко 150г (52)'.")
+            return
         await message.answer("Извините, произошла ошибка при разборе текста (ИИ не смог распознать продукты). Попробуйте перефразировать.")
         return
 
@@ -115,8 +156,10 @@ async def unified_process_input(message: types.Message, text: str, user_id: int,
         meal_groups[key].append((name, weight, m_kcal, k_type))
 
     # 3. Process each group
+    # Сначала собираем все записи, затем пишем их в базу одной транзакцией
     pending_products = []
-    processed_dates = set()
+    batch = []
+    polling_product = None
     
     for (d_val, t_val, is_hist), items in meal_groups.items():
         # Определяем timestamp
@@ -125,32 +168,25 @@ async def unified_process_input(message: types.Message, text: str, user_id: int,
             dt_obj = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
             dt_obj = dt_obj.replace(tzinfo=USER_TZ)
         except:
+            # Неверная дата/время от разбора — пишем как обычный прием сейчас, без перезаписи истории
             dt_obj = now_full
-        
-        processed_dates.add(dt_obj.date())
+            is_hist = False
         
         # ЛОГИКА ПЕРЕЗАПИСИ:
         # Если это исторический лог (указано время), мы сначала удаляем старые записи за эту секунду.
         # Это предотвращает дублирование при повторной отправке одного и того же лога.
-        if is_hist:
-            await repository.delete_meal_at_timestamp(user_id, dt_obj)
-            curr_meal_id = str(uuid.uuid4())
-            await repository.create_meal(curr_meal_id, user_id, timestamp=dt_obj)
+        if is_hist or is_new_meal or not meal_id:
+            group = {"meal_id": str(uuid.uuid4()), "timestamp": dt_obj, "create": True, "overwrite": is_hist, "items": []}
         else:
-            if is_new_meal:
-                curr_meal_id = str(uuid.uuid4())
-                await repository.create_meal(curr_meal_id, user_id, timestamp=dt_obj)
-            else:
-                curr_meal_id = meal_id if meal_id else str(uuid.uuid4())
-                if not meal_id:
-                    await repository.create_meal(curr_meal_id, user_id, timestamp=dt_obj)
-                else:
-                    await repository.update_meal_time(curr_meal_id)
+            group = {"meal_id": meal_id, "timestamp": dt_obj, "create": False, "overwrite": False, "items": []}
+        batch.append(group)
 
         # Обработка продуктов
         for name, weight, m_kcal, k_type in items:
             final_total_kcal = 0
             kcal_per_100_for_db = None
+            product_id = None  # ссылка на справочник — только если калорийность взята из него
+            kcal_source = "manual"
             
             # НОВАЯ ЛОГИКА: Одно поле для ручного ввода
             if m_kcal is not None:
@@ -169,25 +205,35 @@ async def unified_process_input(message: types.Message, text: str, user_id: int,
                 product = await repository.get_product(name)
                 if product:
                     kcal_per_100_for_db = product[2]
+                    product_id = product[0]
+                    kcal_source = "catalog"
                 else:
-                    kcal_per_100_for_db = await ai_service.get_calories_info(name)
+                    kcal_source = "ai"
+                    kcal_per_100_for_db = ai_kcal.get(name)
                     if kcal_per_100_for_db is None:
-                        await state.update_data(polling_product={"name": name, "weight": weight, "meal_id": curr_meal_id, "text": text})
-                        await state.set_state(FoodLogState.waiting_for_kcal)
-                        await message.answer(f"Я не знаю калорийность '{name}'. Сколько в нем ккал на 100г?")
-                        return 
+                        polling_product = {"name": name, "weight": weight, "meal_id": group["meal_id"], "text": text}
+                        break
                     pending_products.append({"name": name, "kcal": kcal_per_100_for_db})
                 
                 final_total_kcal = (weight / 100) * kcal_per_100_for_db
             
-            await repository.add_log(user_id, curr_meal_id, name, weight, final_total_kcal, timestamp=dt_obj)
+            group["items"].append((name, weight, final_total_kcal, product_id, kcal_source))
+
+        if polling_product:
+            break
+
+    processed_dates = await repository.write_meal_batch(user_id, batch)
+
+    if polling_product:
+        await state.update_data(polling_product=polling_product)
+        await state.set_state(FoodLogState.waiting_for_kcal)
+        await message.answer(f"Я не знаю калорийность '{polling_product['name']}'. Сколько в нем ккал на 100г?")
+        return 
 
-    # 4. Generate Reports
+    # 4. Generate Reports (обновляем уже показанный отчет за день, если он рядом)
     try:
         for d_obj in sorted(processed_dates):
-            logs = await repository.get_daily_logs(user_id, d_obj)
-            report_text = await report.generate_day_report(logs)
-            await message.answer(report_text)
+            await show_day_report(message, user_id, d_obj)
     except Exception as e:
         logging.error(f"Error in report: {e}")
 
@@ -215,8 +261,7 @@ async def handle_bulk_save(callback: types.CallbackQuery, state: FSMContext):
     if not pending:
         await callback.answer("Нет продуктов для сохранения.")
         return
-    for p in pending:
-        await repository.add_product(p['name'], p['kcal'], is_verified=True)
+    await repository.add_products([(p['name'], p['kcal']) for p in pending], is_verified=True)
     await callback.message.edit_text(f"✅ Успешно добавлено продуктов: {len(pending)}")
     await state.update_data(pending_add=[])
     await callback.answer()
@@ -236,7 +281,7 @@ async def handle_manual_kcal(message: types.Message, state: FSMContext):
         return
 
     name, weight, meal_id = poll_data['name'], poll_data['weight'], poll_data['meal_id']
-    await repository.add_log(message.from_user.id, meal_id, name, weight, (weight/100)*kcal)
+    await repository.add_log(message.from_user.id, meal_id, name, weight, (weight/100)*kcal, kcal_source="manual")
     
     pending = data.get('pending_add', [])
     pending.append({"name": name, "kcal": kcal})
@@ -245,9 +290,7 @@ async def handle_manual_kcal(message: types.Message, state: FSMContext):
     
     # Репорт
     now = datetime.now(USER_TZ)
-    logs = await repository.get_daily_logs(message.from_user.id, now.date())
-    report_text = await report.generate_day_report(logs)
-    await message.answer(report_text)
+    await show_day_report(message, message.from_user.id, now.date())
     
     # Подтверждение
     items_text = "\n".join([f"🔸 {p['name'].capitalize()}: {int(p['kcal'])} ккал" for p in pending])
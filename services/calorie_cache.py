@@ -0,0 +1,92 @@
+import time
+import logging
+from collections import OrderedDict
+from database import repository
+
+# Время жизни записей (сек)
+POSITIVE_TTL = 30 * 24 * 3600   # найденная калорийность — 30 дней
+NEGATIVE_TTL = 10 * 60          # "ИИ не знает" — 10 минут
+LRU_SIZE = 1000
+
+# Маркер промаха (None — это валидное негативное значение)
+MISS = object()
+
+
+def normalize_key(name):
+    return " ".join(name.lower().split())
+
+
+class CalorieCache:
+    """
+    Двухуровневый кэш калорийности: LRU в памяти процесса + таблица calorie_cache в SQLite.
+    Значение None кэшируется коротко (негативная запись).
+    """
+
+    def __init__(self, max_size=LRU_SIZE):
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.db_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._lru),
+        }
+
+    async def get(self, name):
+        """Возвращает kcal, None (негативная запись) или MISS."""
+        key = normalize_key(name)
+        now = time.time()
+
+        entry = self._lru.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._lru[key]
+            entry = None
+
+        if entry is None:
+            try:
+                row = await repository.get_cached_calories(key)
+            except Exception as e:
+                logging.error(f"Calorie cache read error: {e}")
+                row = None
+            if row and row[1] > now:
+                entry = (row[0], row[1])
+                self._remember(key, entry)
+                self.db_hits += 1
+
+        if entry is None:
+            self.misses += 1
+            return MISS
+
+        self._lru.move_to_end(key)
+        self.hits += 1
+        if entry[0] is None:
+            self.negative_hits += 1
+        return entry[0]
+
+    async def put(self, name, kcal):
+        key = normalize_key(name)
+        ttl = POSITIVE_TTL if kcal is not None else NEGATIVE_TTL
+        entry = (kcal, time.time() + ttl)
+        self._remember(key, entry)
+        try:
+            await repository.set_cached_calories(key, kcal, entry[1])
+        except Exception as e:
+            logging.error(f"Calorie cache write error: {e}")
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+
+calorie_cache = CalorieCache()
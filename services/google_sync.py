@@ -1,17 +1,33 @@
 import os.path
+import asyncio
 import logging
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
+from config import GOOGLE_DOCS_ENDPOINT, GOOGLE_SYNC_WORKERS
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
 
+# Ограничение размера одного batchUpdate (символов текста)
+MAX_BATCH_CHARS = 100_000
+
+# Вызовы Google API блокирующие — выполняем их в отдельном пуле потоков.
+# httplib2 не потокобезопасен, поэтому у каждого потока пула свой закэшированный клиент.
+_executor = ThreadPoolExecutor(max_workers=GOOGLE_SYNC_WORKERS, thread_name_prefix="gdocs")
+_local = threading.local()
+
 def get_service():
-    """Builds and returns the Google Docs service."""
+    """Builds and returns the Google Docs service (cached per thread)."""
+    service = getattr(_local, "service", None)
+    if service is not None:
+        return service
+
     creds_path = 'credentials.json'
     if not os.path.exists(creds_path):
         logging.error("credentials.json not found!")
@@ -19,53 +35,64 @@ def get_service():
     
     try:
         creds = service_account.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
-        service = build('docs', 'v1', credentials=creds)
+        # GOOGLE_DOCS_ENDPOINT позволяет направить запросы на локальный сервер (тесты)
+        client_options = {"api_endpoint": GOOGLE_DOCS_ENDPOINT} if GOOGLE_DOCS_ENDPOINT else None
+        service = build('docs', 'v1', credentials=creds, client_options=client_options, static_discovery=True)
+        _local.service = service
         return service
     except Exception as e:
         logging.error(f"Error connecting to Google Docs: {e}")
         return None
 
-async def append_to_doc(doc_id: str, text: str):
-    """Appends text to the end of a Google Doc."""
-    # Clean doc_id (handle both full URLs and raw IDs)
+def clean_doc_id(doc_id: str):
+    """Accepts both full document URLs and raw IDs."""
     if "docs.google.com/document/d/" in doc_id:
         doc_id = doc_id.split("/d/")[1].split("/")[0]
+    return doc_id
 
+def _batch_update(doc_id, requests):
     service = get_service()
     if not service:
-        logging.error("Failed to get Google Docs service.")
-        return False
-    
-    try:
-        # 1. Get current doc to find the total length (end index)
-        doc = service.documents().get(documentId=doc_id).execute()
-        content = doc.get('body').get('content')
-        end_index = content[-1].get('endIndex') - 1
-        if end_index < 1: end_index = 1
+        raise RuntimeError("Failed to get Google Docs service.")
+    return service.documents().batchUpdate(documentId=doc_id, body={'requests': requests}).execute()
 
-        print(f"DEBUG [v2.1]: Doc length is {end_index}. Appending...")
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
 
-        # If document is not empty, add a page break FIRST
-        if end_index > 2:
-            service.documents().batchUpdate(documentId=doc_id, body={
-                'requests': [{'insertPageBreak': {'location': {'index': end_index}}}]
-            }).execute()
-            # After inserting a page break, the document length increases by 1
-            end_index += 1
+def append_requests(text: str):
+    """Запросы batchUpdate для дописывания отчета в конец документа: разрыв страницы + текст."""
+    # endOfSegmentLocation — конец тела документа, поэтому не нужен documents().get за текущей длиной
+    return [
+        {'insertPageBreak': {'endOfSegmentLocation': {}}},
+        {'insertText': {'endOfSegmentLocation': {}, 'text': f"\n{text}\n"}},
+    ]
 
-        # Now insert the text
-        service.documents().batchUpdate(documentId=doc_id, body={
-            'requests': [{
-                'insertText': {
-                    'location': {'index': end_index},
-                    'text': f"\n{text}\n"
-                }
-            }]
-        }).execute()
+async def append_many(doc_id: str, texts):
+    """
+    Appends several reports to the end of a Google Doc, each after a page break.
+    Reports are packed into as few batchUpdate calls as possible (up to MAX_BATCH_CHARS each).
+    Requests inside a batchUpdate are applied in order and every one targets the end of the body,
+    so no index arithmetic is needed.
+    Returns (how many reports were appended, in order; error of the failed batchUpdate or None).
+    """
+    doc_id = clean_doc_id(doc_id)
+    chunks = []
+    size = MAX_BATCH_CHARS
+    for text in texts:
+        if size + len(text) > MAX_BATCH_CHARS:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(text)
+        size += len(text)
 
-        print(f"✅ [v2.1] Синхронизация завершена (ID: {doc_id})")
-        return True
-    except Exception as e:
-        print(f"❌ Ошибка Google Docs API: {e}")
-        logging.error(f"Error appending to Google Doc: {e}")
-        return False
+    appended = 0
+    for chunk in chunks:
+        requests = [request for text in chunk for request in append_requests(text)]
+        try:
+            await _run(_batch_update, doc_id, requests)
+        except Exception as e:
+            logging.error(f"Error appending to Google Doc {doc_id} after {appended}/{len(texts)} reports: {e}")
+            return appended, e
+        appended += len(chunk)
+    return appended, None
@@ -1,18 +1,87 @@
-from groq import Groq
+from groq import AsyncGroq
+import asyncio
 import re
 import json
-from config import GROQ_API_KEY
+import time
+from config import (
+    GROQ_API_KEY, GROQ_BASE_URL, GEMINI_API_KEY, GEMINI_BASE_URL, GEMINI_MODEL,
+    LLM_MAX_CONCURRENCY, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_HEDGE_PERCENTILE, LLM_HEDGE_DELAY
+)
+from services.llm_dispatcher import LLMDispatcher, CircuitOpenError
+from services.llm_providers import GroqProvider, GeminiProvider, HedgedLLM
+from services.calorie_cache import calorie_cache, normalize_key, MISS
+from services.parse_cache import parse_cache, make_key
+from services.local_parser import local_parser
+from services.singleflight import singleflight
+from services.json_stream import JsonArrayStream
+from services.metrics import LatencyHistogram
 
-# Инициализируем Groq клиент
-client = Groq(api_key=GROQ_API_KEY)
+# Инициализируем асинхронный Groq клиент (не блокирует event loop).
+# Повторы выполняет диспетчер, поэтому встроенные повторы клиента отключены.
+client = AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=LLM_TIMEOUT, max_retries=0)
 
 # Выбор модели (быстрая и надежная)
 MODEL_NAME = "llama-3.3-70b-versatile"  # Лучшая для парсинга текста
 
+# Очередь, лимиты, повторы и circuit breaker для всех запросов к Groq
+dispatcher = LLMDispatcher("groq", max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+
+providers = [GroqProvider(client, MODEL_NAME, dispatcher)]
+if GEMINI_API_KEY:
+    from google import genai
+    from google.genai import types as genai_types
+
+    # Повторы выполняет диспетчер; timeout в HttpOptions задается в миллисекундах
+    gemini_client = genai.Client(
+        api_key=GEMINI_API_KEY,
+        http_options=genai_types.HttpOptions(
+            base_url=GEMINI_BASE_URL,
+            timeout=int(LLM_TIMEOUT * 1000),
+            retry_options=genai_types.HttpRetryOptions(attempts=1)
+        )
+    )
+    gemini_dispatcher = LLMDispatcher("gemini", max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+    providers.append(GeminiProvider(gemini_client, GEMINI_MODEL, gemini_dispatcher))
+
+# Запросы идут в Groq; при долгом ответе или отказе дублируются в Gemini
+llm = HedgedLLM(providers, hedge_percentile=LLM_HEDGE_PERCENTILE, default_delay=LLM_HEDGE_DELAY)
+
+# Замеры разбора: полный ответ против потокового (время до первого продукта и общее)
+parse_timings = {
+    "blocking_total": LatencyHistogram(),
+    "stream_first_item": LatencyHistogram(),
+    "stream_total": LatencyHistogram(),
+}
+
+async def _complete(messages, temperature, max_tokens, kind):
+    """Один запрос к модели: первый валидный ответ из провайдеров (hedging по задержкам запросов типа kind)."""
+    return await llm.complete(messages, temperature, max_tokens, kind=kind)
+
 async def parse_food_input(text):
     """
     Разбирает текст с помощью Groq и возвращает список кортежей.
+    Типичные сообщения разбираются локально, повторный текст берется из кэша разборов — без запроса к ИИ.
     """
+    fast_items = local_parser.parse(text)
+    if fast_items:
+        print(f"Fast-path parsed '{text}' ({len(fast_items)} items)")
+        return fast_items
+
+    cached = parse_cache.get(text)
+    if cached is not None:
+        print(f"Parse cache hit for '{text}' ({len(cached)} items)")
+        return cached
+
+    # Одинаковые тексты, которые разбираются прямо сейчас (обычным запросом или потоком), ждут общий ответ ИИ
+    key = ("parse", make_key(text))
+    try:
+        return await singleflight.do(key, lambda: _parse_with_llm(text))
+    except Exception as e:
+        # Общий потоковый разбор оборвался — разбираем обычным запросом (тоже общим для одинаковых текстов)
+        print(f"Shared streaming parse failed ({e}), parsing '{text}' again")
+        return await singleflight.do(key, lambda: _parse_with_llm(text))
+
+def _parse_messages(text):
     prompt = f"""Parse this food list into JSON. Return ONLY the JSON array, no explanations.
 
 Input: {text}
@@ -41,22 +110,35 @@ Output: [
   {{"name": "кумыс", "weight": 500, "manual_kcal": 100, "kcal_type": "per_100", "date": "2026-01-22", "time": "05:00"}}
 ]
 """
+    return [
+        {"role": "system", "content": "You are a helpful assistant that parses food data into JSON. Return ONLY valid JSON array, no explanations."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _item_to_tuple(item):
+    name = item.get('name')
+    raw_weight = item.get('weight')
+    weight = float(raw_weight) if raw_weight is not None else 0.0
+    
+    manual_kcal = item.get('manual_kcal')
+    kcal_type = item.get('kcal_type')
+    date = item.get('date')
+    time = item.get('time')
     
+    return (name, weight, manual_kcal, kcal_type, date, time)
+
+async def _parse_with_llm(text):
+    """Разбор текста через Groq (без кэшей)."""
+    started = time.perf_counter()
     try:
-        # Используем Groq API (синхронный, оборачиваем в async)
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that parses food data into JSON. Return ONLY valid JSON array, no explanations."},
-                {"role": "user", "content": prompt}
-            ],
+        # Используем асинхронный Groq API
+        text_response = await _complete(
+            messages=_parse_messages(text),
             temperature=0,
-            max_tokens=4000
+            max_tokens=4000,
+            kind="parse"
         )
         
-        # Получаем ответ
-        text_response = response.choices[0].message.content
-        
         # Очистка: ищем JSON массив в ответе
         cleaned_text = text_response.strip()
         
@@ -75,24 +157,15 @@ Output: [
         # Парсим JSON
         data = json.loads(json_str)
         
-        results = []
-        for item in data:
-            name = item.get('name')
-            raw_weight = item.get('weight')
-            weight = float(raw_weight) if raw_weight is not None else 0.0
-            
-            manual_kcal = item.get('manual_kcal')
-            kcal_type = item.get('kcal_type')
-            date = item.get('date')
-            time = item.get('time')
-            
-            results.append((name, weight, manual_kcal, kcal_type, date, time))
+        results = [_item_to_tuple(item) for item in data]
+        parse_timings["blocking_total"].record(time.perf_counter() - started)
             
         # Logging for debugging
         print(f"Groq parsed from '{text}':")
         for name, weight, m_kcal, k_type, d, t in results:
             print(f"  - {name}: {weight}g, manual: {m_kcal} ({k_type}), date: {d}, time: {t}")
             
+        parse_cache.put(text, results)
         return results
         
     except json.JSONDecodeError as e:
@@ -100,14 +173,99 @@ Output: [
         print(f"Attempted to parse: {json_str if 'json_str' in locals() else cleaned_text}")
         return []
         
+    except asyncio.TimeoutError:
+        print(f"Groq parse timeout after {LLM_TIMEOUT}s")
+        return []
+        
+    except CircuitOpenError as e:
+        print(f"Groq parse skipped: {e}")
+        return []
+        
     except Exception as e:
         print(f"Groq parse error: {e}")
         return []
 
-async def get_calories_info(product_name):
+async def stream_food_input(text):
+    """
+    Потоковый вариант parse_food_input: отдает кортежи по одному, как только
+    очередной элемент JSON-массива полностью пришел от модели.
+    Ошибки запроса и оборванный ответ (нет закрывающей ']', например уперлись в max_tokens)
+    пробрасываются — вызывающий может вернуться к parse_food_input. Неполный результат не кэшируется.
+    Если такой же текст уже разбирается, поток не открывается: ждем общий результат (singleflight).
+    """
+    fast_items = local_parser.parse(text)
+    if fast_items:
+        print(f"Fast-path parsed '{text}' ({len(fast_items)} items)")
+        for item in fast_items:
+            yield item
+        return
+
+    cached = parse_cache.get(text)
+    if cached is not None:
+        print(f"Parse cache hit for '{text}' ({len(cached)} items)")
+        for item in cached:
+            yield item
+        return
+
+    key = ("parse", make_key(text))
+    shared = singleflight.join(key)
+    if shared is not None:
+        print(f"Joining in-flight parse for '{text}'")
+        for item in await asyncio.shield(shared):
+            yield item
+        return
+
+    # Одинаковые тексты (потоковые и обычные) получат готовый список этого разбора
+    flight = asyncio.get_running_loop().create_future()
+    singleflight.start(key, flight)
+    results = []
+    try:
+        started = time.perf_counter()
+        # Hedging по времени до первого фрагмента: медленный поток дублируется другому провайдеру
+        stream = await llm.open_stream(_parse_messages(text), temperature=0, max_tokens=4000, kind="parse_stream")
+        decoder = JsonArrayStream()
+        try:
+            while not decoder.finished:
+                try:
+                    piece = await asyncio.wait_for(stream.__anext__(), timeout=LLM_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                for item in decoder.feed(piece):
+                    if not results:
+                        parse_timings["stream_first_item"].record(time.perf_counter() - started)
+                    results.append(_item_to_tuple(item))
+                    yield results[-1]
+        finally:
+            await stream.aclose()
+
+        if not decoder.finished:
+            raise ValueError(f"LLM stream ended before the closing ']' ({len(results)} items received)")
+    except BaseException as e:
+        # Ожидающие получают ошибку (и сами переходят к обычному разбору), а не зависают
+        if not flight.done():
+            flight.set_exception(e if isinstance(e, Exception) else RuntimeError("streaming parse was interrupted"))
+        raise
+
+    parse_timings["stream_total"].record(time.perf_counter() - started)
+    print(f"LLM streamed {len(results)} items from '{text}'")
+    parse_cache.put(text, results)
+    flight.set_result(list(results))
+
+async def get_calories_info(product_name, use_cache=True, refresh=False):
     """
-    Ищет калорийность продукта через Groq.
+    Ищет калорийность продукта: сначала в кэше, затем через Groq.
+    use_cache=False — не читать и не писать кэш; refresh=True — спросить ИИ заново и обновить кэш.
     """
+    if use_cache and not refresh:
+        cached = await calorie_cache.get(product_name)
+        if cached is not MISS:
+            return cached
+
+    # Одновременные запросы того же продукта получают один общий ответ ИИ
+    return await singleflight.do(("kcal", normalize_key(product_name)), lambda: _lookup_calories(product_name, use_cache))
+
+async def _lookup_calories(product_name, use_cache=True):
+    """Запрос калорийности у Groq (без чтения кэша)."""
     prompt = f"""
     Сколько калорий в продукте '{product_name}' на 100 грамм?
     
@@ -120,24 +278,153 @@ async def get_calories_info(product_name):
     """
     
     try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
+        response_text = await _complete(
             messages=[
                 {"role": "system", "content": "You are a nutrition expert. Answer with numbers only."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,
-            max_tokens=50
+            max_tokens=50,
+            kind="lookup"
         )
         
-        text = response.choices[0].message.content.strip()
+        text = response_text.strip()
         match = re.search(r'\d+', text)
+        kcal = None
         if match:
             kcal = int(match.group())
             print(f"Groq calories for '{product_name}': {kcal} kcал/100г")
-            return kcal
+        
+    except asyncio.TimeoutError:
+        print(f"Groq lookup timeout after {LLM_TIMEOUT}s")
+        return None
+        
+    except CircuitOpenError as e:
+        print(f"Groq lookup skipped: {e}")
         return None
         
     except Exception as e:
         print(f"Groq lookup error: {e}")
         return None
+
+    # Ошибки API не кэшируются, а "не знаю" (None) — кэшируется ненадолго
+    if use_cache:
+        await calorie_cache.put(product_name, kcal)
+    return kcal
+
+def _parse_kcal_map(response_text):
+    """Достает из ответа JSON-объект {"название": ккал} с нормализованными ключами."""
+    cleaned_text = response_text.replace("```json", "").replace("```", "").strip()
+    start_idx = cleaned_text.find('{')
+    end_idx = cleaned_text.rfind('}')
+    if start_idx == -1 or end_idx == -1:
+        return {}
+    data = json.loads(cleaned_text[start_idx:end_idx+1])
+    if not isinstance(data, dict):
+        return {}
+
+    result = {}
+    for name, value in data.items():
+        match = re.search(r'\d+', str(value)) if value is not None else None
+        if match:
+            result[normalize_key(str(name))] = int(match.group())
+    return result
+
+async def get_calories_info_batch(product_names, use_cache=True, refresh=False):
+    """
+    Калорийность нескольких продуктов одним запросом к Groq.
+    Возвращает {название: ккал или None}. Если ответ неполный или битый —
+    недостающие продукты запрашиваются по одному (параллельно).
+    """
+    results = {}
+    # Повторы с другим регистром/пробелами запрашиваются один раз
+    unique_names = list({normalize_key(name): name for name in product_names}.values())
+    to_resolve = []
+    for name in unique_names:
+        if use_cache and not refresh:
+            cached = await calorie_cache.get(name)
+            if cached is not MISS:
+                results[name] = cached
+                continue
+        to_resolve.append(name)
+
+    # Без await между проверкой и регистрацией, чтобы параллельные вызовы не продублировали запрос
+    waiting = {}
+    to_fetch = []
+    for name in to_resolve:
+        # Продукт уже запрашивается другим пользователем/сообщением — ждем тот же ответ
+        inflight = singleflight.join(("kcal", normalize_key(name)))
+        if inflight is not None:
+            waiting[name] = inflight
+        else:
+            to_fetch.append(name)
+
+    if len(to_fetch) == 1:
+        name = to_fetch[0]
+        waiting[name] = singleflight.start(("kcal", normalize_key(name)), _lookup_calories(name, use_cache))
+    elif to_fetch:
+        batch_task = asyncio.ensure_future(_lookup_calories_batch(to_fetch, use_cache))
+        for name in to_fetch:
+            waiting[name] = singleflight.start(("kcal", normalize_key(name)), _pick(batch_task, name))
+
+    for name, task in waiting.items():
+        results[name] = await asyncio.shield(task)
+    by_key = {normalize_key(name): kcal for name, kcal in results.items()}
+    return {name: by_key[normalize_key(name)] for name in product_names}
+
+async def _pick(batch_task, name):
+    batch = await asyncio.shield(batch_task)
+    return batch.get(name)
+
+async def _lookup_calories_batch(to_fetch, use_cache=True):
+    """Один запрос к Groq на список продуктов (без чтения кэша)."""
+    results = {}
+    products_list = "\n".join(f"- {name}" for name in to_fetch)
+    prompt = f"""
+    Сколько калорий на 100 грамм в каждом из продуктов?
+    
+    Продукты:
+{products_list}
+    
+    Важно:
+    - ОБЯЗАТЕЛЬНО учитывай жирность/процент, если они указаны в названии (например, для 'творог 5%' и 'творог 9%' значения разные).
+    - Если название неполное (например, "гречка"), предполагай самую распространённую приготовленную версию.
+    - НИКОГДА не возвращай 0 для съедобных продуктов.
+    - Если не уверен, предоставь среднюю оценку для этой категории еды.
+    - Верни ТОЛЬКО JSON-объект {{"название": целое число}}, названия — в точности как в списке.
+    """
+
+    batch = {}
+    try:
+        response_text = await _complete(
+            messages=[
+                {"role": "system", "content": "You are a nutrition expert. Return ONLY a valid JSON object, no explanations."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1,
+            max_tokens=50 + 20 * len(to_fetch),
+            kind="lookup_batch"
+        )
+        batch = _parse_kcal_map(response_text)
+    except asyncio.TimeoutError:
+        print(f"Groq batch lookup timeout after {LLM_TIMEOUT}s")
+    except Exception as e:
+        print(f"Groq batch lookup error: {e}")
+
+    missing = []
+    for name in to_fetch:
+        kcal = batch.get(normalize_key(name))
+        if kcal is None:
+            missing.append(name)
+            continue
+        print(f"Groq calories for '{name}': {kcal} kcал/100г (batch)")
+        results[name] = kcal
+        if use_cache:
+            await calorie_cache.put(name, kcal)
+
+    if missing:
+        print(f"Batch lookup incomplete, single lookups for: {missing}")
+        singles = await asyncio.gather(*(_lookup_calories(name, use_cache) for name in missing))
+        results.update(zip(missing, singles))
+
+    return results
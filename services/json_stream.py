@@ -0,0 +1,55 @@
+import json
+
+
+class JsonArrayStream:
+    """
+    Инкрементальный разбор JSON-массива объектов из потока текста.
+    feed() принимает очередной фрагмент ответа и возвращает объекты, которые уже полностью пришли.
+    Текст до '[' (например, ```json) пропускается.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = None  # позиция после '[' / после последнего разобранного элемента
+        self.finished = False
+
+    def feed(self, chunk):
+        if self.finished:
+            return []
+        self._buffer += chunk
+
+        if self._pos is None:
+            start = self._buffer.find('[')
+            if start == -1:
+                return []
+            self._pos = start + 1
+
+        items = []
+        while True:
+            pos = self._skip_separators(self._pos)
+            if pos >= len(self._buffer):
+                break
+            if self._buffer[pos] == ']':
+                self.finished = True
+                break
+            if self._buffer[pos] != '{':
+                raise ValueError(f"Unexpected array element at {pos}: {self._buffer[pos:pos + 20]!r}")
+            try:
+                obj, end = self._decoder.raw_decode(self._buffer, pos)
+            except json.JSONDecodeError:
+                # Элемент еще не пришел целиком
+                break
+            items.append(obj)
+            self._pos = end
+
+        # Разобранную часть буфера больше не храним
+        if self._pos > 4096:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return items
+
+    def _skip_separators(self, pos):
+        while pos < len(self._buffer) and self._buffer[pos] in " \t\r\n,":
+            pos += 1
+        return pos
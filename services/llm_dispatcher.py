@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import random
+import re
+import time
+
+# Коды ответа, после которых есть смысл повторить запрос
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Провайдер недавно много раз подряд отказывал — запрос отклонен без обращения к API."""
+
+
+def parse_duration(value):
+    """Длительность из заголовков rate limit: '59.56s', '2m59.56s', '200ms', '7' -> секунды."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value):
+        matched = True
+        amount = float(amount)
+        total += {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit] * amount
+    return total if matched else None
+
+
+def _status_of(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def _headers_of(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+
+def is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = _status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    # Ошибки соединения/таймауты клиентов API (APIConnectionError, APITimeoutError, ...)
+    name = type(error).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+class LLMDispatcher:
+    """
+    Диспетчер запросов к LLM:
+    - ограничение параллельных запросов (очередь видна через queue_depth);
+    - бюджет запросов/токенов в минуту по заголовкам x-ratelimit-*;
+    - повторы с экспоненциальной задержкой и jitter (учитывает retry-after);
+    - circuit breaker: после failure_threshold неудач подряд запросы отклоняются сразу.
+
+    request — корутинная функция без аргументов, возвращающая (результат, заголовки ответа).
+    """
+
+    def __init__(self, name, max_concurrency, timeout, max_retries=3, base_delay=0.5, max_delay=20.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+
+        # Бюджет по заголовкам провайдера
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+
+        # Circuit breaker
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._half_open_trial = False
+
+        self.retries = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self):
+        return self.waiting
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def stats(self):
+        return {
+            "queue_depth": self.waiting,
+            "active": self.active,
+            "circuit": "open" if self.is_open else ("half-open" if self.opened_at else "closed"),
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+        }
+
+    async def call(self, request, estimated_tokens=0):
+        attempt = 0
+        while True:
+            self._check_circuit()
+            retry_after = None
+            try:
+                result, headers = await self._attempt(request, estimated_tokens)
+            except asyncio.CancelledError:
+                # Отмененный пробный запрос (например, проигравший hedge) не должен блокировать провайдер
+                self._release_trial()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    self._release_trial()
+                    raise
+                self._record_failure()
+                headers = _headers_of(e)
+                self._update_budget(headers)
+                if _status_of(e) == 429:
+                    self.throttled += 1
+                retry_after = parse_duration(headers.get("retry-after")) if headers else None
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                attempt += 1
+                self.retries += 1
+                logging.warning(f"[{self.name}] LLM error ({type(e).__name__}: {e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            self._update_budget(headers)
+            self._record_success()
+            return result
+
+    async def _attempt(self, request, estimated_tokens):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            await self._wait_for_budget(estimated_tokens)
+            return await asyncio.wait_for(request(), timeout=self.timeout)
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def _wait_for_budget(self, estimated_tokens):
+        now = time.time()
+        wait = 0.0
+        if self.remaining_requests is not None and self.remaining_requests < 1 and self.requests_reset_at > now:
+            wait = max(wait, self.requests_reset_at - now)
+        if self.remaining_tokens is not None and self.remaining_tokens < estimated_tokens and self.tokens_reset_at > now:
+            wait = max(wait, self.tokens_reset_at - now)
+        if wait > 0:
+            self.throttled += 1
+            logging.info(f"[{self.name}] Rate limit budget exhausted, waiting {wait:.1f}s")
+            await asyncio.sleep(min(wait, self.max_delay))
+            # Бюджет обновится по заголовкам следующего ответа
+            self.remaining_requests = None
+            self.remaining_tokens = None
+        elif self.remaining_requests is not None:
+            self.remaining_requests -= 1
+            if self.remaining_tokens is not None:
+                self.remaining_tokens -= estimated_tokens
+
+    def _update_budget(self, headers):
+        if not headers:
+            return
+        now = time.time()
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None:
+            try:
+                self.remaining_requests = int(float(remaining))
+            except ValueError:
+                pass
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if remaining is not None:
+            try:
+                self.remaining_tokens = int(float(remaining))
+            except ValueError:
+                pass
+        reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        if reset is not None:
+            self.requests_reset_at = now + reset
+        reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+        if reset is not None:
+            self.tokens_reset_at = now + reset
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _check_circuit(self):
+        if self.opened_at is None:
+            return
+        if self.is_open or self._half_open_trial:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name}: circuit open after {self.consecutive_failures} failures")
+        # Half-open: пропускаем один пробный запрос
+        self._half_open_trial = True
+
+    def _release_trial(self):
+        self._half_open_trial = False
+
+    def _record_failure(self):
+        self.consecutive_failures += 1
+        self._half_open_trial = False
+        if self.consecutive_failures >= self.failure_threshold:
+            if not self.is_open:
+                logging.error(f"[{self.name}] Circuit opened after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
+
+    def _record_success(self):
+        if self.opened_at is not None:
+            logging.info(f"[{self.name}] Circuit closed")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._half_open_trial = False
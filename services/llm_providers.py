@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import time
+
+from services.metrics import LatencyByKind
+
+
+def estimate_tokens(messages, max_tokens):
+    # Грубая оценка токенов: ~4 символа на токен + максимум ответа
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+
+async def _timed(latency, kind, awaitable):
+    """
+    Замер времени запроса в гистограмму kind. Отмененный (проигравший hedge) или оборванный
+    по таймауту запрос шел не меньше замеренного — пишем как нижнюю оценку, иначе медленные
+    ответы выпадают из окна и перцентиль (а с ним и задержка до дубля) занижается.
+    """
+    started = time.perf_counter()
+    try:
+        result = await awaitable
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        latency.record(kind, time.perf_counter() - started, censored=True)
+        raise
+    latency.record(kind, time.perf_counter() - started)
+    return result
+
+
+class TextStream:
+    """Потоковый ответ модели: асинхронный итератор фрагментов текста, первый фрагмент уже получен."""
+
+    def __init__(self, first, pieces):
+        self.first = first
+        self._pieces = pieces
+        self._first_sent = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._first_sent:
+            self._first_sent = True
+            if self.first is not None:
+                return self.first
+        return await self._pieces.__anext__()
+
+    async def aclose(self):
+        await self._pieces.aclose()
+
+
+async def _first_piece(pieces):
+    """Ждет первый фрагмент потока (время до первого токена) и возвращает TextStream."""
+    try:
+        first = await pieces.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await pieces.aclose()
+        raise
+    return TextStream(first, pieces)
+
+
+class GroqProvider:
+    """Chat completions Groq через диспетчер (очередь, бюджет rate limit, повторы, таймаут)."""
+
+    def __init__(self, client, model, dispatcher):
+        self.name = "groq"
+        self.client = client
+        self.model = model
+        self.dispatcher = dispatcher
+        self.latency = LatencyByKind()
+
+    async def complete(self, messages, temperature, max_tokens, kind="default"):
+        async def request():
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            return await raw.parse(), raw.headers
+
+        call = self.dispatcher.call(request, estimated_tokens=estimate_tokens(messages, max_tokens))
+        response = await _timed(self.latency, kind, call)
+        return response.choices[0].message.content
+
+    async def open_stream(self, messages, temperature, max_tokens, kind="stream"):
+        """Открывает потоковый ответ; в гистограмму kind идет время до первого фрагмента текста."""
+        return await _timed(self.latency, kind, _first_piece(self._pieces(messages, temperature, max_tokens)))
+
+    async def _pieces(self, messages, temperature, max_tokens):
+        async def request():
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            return await raw.parse(), raw.headers
+
+        # Повторы диспетчера возможны только до начала потока
+        stream = await self.dispatcher.call(request, estimated_tokens=estimate_tokens(messages, max_tokens))
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+
+class GeminiProvider:
+    """Gemini (google-genai) через свой диспетчер. Сообщения в формате OpenAI переводятся в contents."""
+
+    def __init__(self, client, model, dispatcher):
+        self.name = "gemini"
+        self.client = client
+        self.model = model
+        self.dispatcher = dispatcher
+        self.latency = LatencyByKind()
+
+    @staticmethod
+    def _request_args(messages, temperature, max_tokens):
+        from google.genai import types
+
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        contents = [
+            types.Content(role="model" if m["role"] == "assistant" else "user", parts=[types.Part(text=m["content"])])
+            for m in messages if m["role"] != "system"
+        ]
+        config = types.GenerateContentConfig(
+            system_instruction=system or None,
+            temperature=temperature,
+            max_output_tokens=max_tokens
+        )
+        return contents, config
+
+    async def complete(self, messages, temperature, max_tokens, kind="default"):
+        contents, config = self._request_args(messages, temperature, max_tokens)
+
+        async def request():
+            response = await self.client.aio.models.generate_content(model=self.model, contents=contents, config=config)
+            http_response = getattr(response, "sdk_http_response", None)
+            return response, getattr(http_response, "headers", None)
+
+        call = self.dispatcher.call(request, estimated_tokens=estimate_tokens(messages, max_tokens))
+        response = await _timed(self.latency, kind, call)
+        return response.text
+
+    async def open_stream(self, messages, temperature, max_tokens, kind="stream"):
+        """Открывает потоковый ответ; в гистограмму kind идет время до первого фрагмента текста."""
+        return await _timed(self.latency, kind, _first_piece(self._pieces(messages, temperature, max_tokens)))
+
+    async def _pieces(self, messages, temperature, max_tokens):
+        contents, config = self._request_args(messages, temperature, max_tokens)
+
+        async def request():
+            stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=contents, config=config)
+            return stream, None
+
+        stream = await self.dispatcher.call(request, estimated_tokens=estimate_tokens(messages, max_tokens))
+        try:
+            async for response in stream:
+                if response.text:
+                    yield response.text
+        finally:
+            await stream.aclose()
+
+
+def _non_empty(text):
+    return bool(text and text.strip())
+
+
+class HedgedLLM:
+    """
+    Hedged-запросы к нескольким провайдерам: запрос уходит первому провайдеру; если тот не ответил
+    за hedge_delay (перцентиль его задержки), запрос дублируется следующему.
+    Берется первый валидный ответ, остальные запросы отменяются.
+    Если провайдер отказал (ошибка, circuit breaker), следующий запускается сразу.
+    Задержки считаются отдельно для каждого типа запроса (kind): у разбора и поиска калорийности
+    разная длина ответа, а у потока важен только первый фрагмент.
+    """
+
+    def __init__(self, providers, hedge_percentile=95, default_delay=2.0, min_delay=0.3, min_samples=20):
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @property
+    def primary(self):
+        return self.providers[0]
+
+    @property
+    def queue_depth(self):
+        return self.primary.dispatcher.queue_depth
+
+    @property
+    def is_open(self):
+        """Все провайдеры недоступны (circuit breaker открыт у каждого)."""
+        return all(p.dispatcher.is_open for p in self.providers)
+
+    def hedge_delay(self, kind="default"):
+        histogram = self.primary.latency[kind]
+        # Пока замеров мало, перцентиль ненадежен — используем задержку по умолчанию
+        if len(histogram) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, histogram.percentile(self.hedge_percentile))
+
+    def stats(self):
+        return {
+            "hedge_delay": {kind: round(self.hedge_delay(kind), 3) for kind in self.primary.latency.kinds()},
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "providers": {p.name: {"latency": p.latency.summary(), **p.dispatcher.stats()} for p in self.providers},
+        }
+
+    async def complete(self, messages, temperature, max_tokens, validate=_non_empty, kind="default"):
+        return await self._race(lambda p: p.complete(messages, temperature, max_tokens, kind), kind, validate)
+
+    async def open_stream(self, messages, temperature, max_tokens, kind="stream"):
+        """
+        Hedging открытия потока: дубль уходит, если первый фрагмент текста не пришел за hedge_delay.
+        Возвращает TextStream победителя; потоки остальных провайдеров закрываются.
+        """
+        return await self._race(
+            lambda p: p.open_stream(messages, temperature, max_tokens, kind),
+            kind,
+            validate=lambda stream: bool(stream.first),
+            discard=lambda stream: stream.aclose()
+        )
+
+    async def _race(self, start, kind, validate, discard=None):
+        waiting = list(self.providers)
+        pending = {}
+        first_error = None
+
+        def launch():
+            provider = waiting.pop(0)
+            task = asyncio.create_task(start(provider))
+            pending[task] = provider
+
+        launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(kind) if waiting else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Первый провайдер отвечает дольше обычного — дублируем запрос
+                    self.hedged += 1
+                    logging.info(f"LLM hedge ({kind}): no answer in {timeout:.2f}s, asking {waiting[0].name}")
+                    launch()
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logging.warning(f"LLM provider {provider.name} failed: {type(e).__name__}: {e}")
+                        first_error = first_error or e
+                        continue
+                    if validate(result):
+                        if provider is not self.primary:
+                            self.hedge_wins += 1
+                        return result
+                    logging.warning(f"LLM provider {provider.name} returned invalid response: {result!r:.200}")
+                    if discard:
+                        await discard(result)
+
+                if not pending and waiting:
+                    self.failovers += 1
+                    launch()
+
+            if first_error is not None:
+                raise first_error
+            raise ValueError("No valid LLM response")
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                elif discard and not task.cancelled() and task.exception() is None:
+                    # Ответ пришел одновременно с победителем — освобождаем его (например, закрываем поток)
+                    await discard(task.result())
@@ -0,0 +1,158 @@
+import datetime
+import re
+
+# Множители единиц веса к граммам (мл считаем как граммы)
+UNITS = {
+    "г": 1, "гр": 1, "g": 1,
+    "кг": 1000, "kg": 1000,
+    "мл": 1, "ml": 1,
+    "л": 1000, "l": 1000,
+}
+
+_NUM = r"\d+(?:[.,]\d+)?"
+_UNIT = r"(?:кг|kg|гр|г|g|мл|ml|л|l)\.?"
+
+_DATE = re.compile(r"^(\d{1,2})[./](\d{1,2})[./](\d{2}|\d{4})$")
+_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+# Разделитель списка: запятая/точка с запятой, но не десятичная запятая (2,5%)
+_SPLIT = re.compile(r"\s*;\s*|(?<!\d),\s*|,(?!\d)\s*")
+
+_WEIGHT = re.compile(rf"(?<![\w%.,])({_NUM})\s*({_UNIT})(?!\w)", re.IGNORECASE)
+_PER_100 = re.compile(rf"\(\s*({_NUM})\s*(?:ккал|kcal)?\s*\)", re.IGNORECASE)
+_TOTAL = re.compile(rf"(?:[-–—:]\s*)?({_NUM})\s*(?:ккал|kcal)\.?$", re.IGNORECASE)
+
+
+def _to_float(value):
+    return float(value.replace(",", "."))
+
+
+def _parse_date(match):
+    first, second, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+    if year < 100:
+        year += 2000
+    # dd/mm по умолчанию (как в подсказке "Другой день"), mm/dd — если иначе невозможно
+    if second > 12 and first <= 12:
+        month, day = first, second
+    else:
+        day, month = first, second
+    # Несуществующая дата (31/02) — не разбираем локально, пусть текст уйдет ИИ
+    try:
+        return datetime.date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _parse_time(match):
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _parse_item(segment):
+    """Одна позиция: 'Яблоко 150г', 'Кумыс 500г (100)', 'Творожная масса 200г - 304 ккал', 'Сок 120 ккал'."""
+    rest = segment
+    manual_kcal = None
+    kcal_type = None
+
+    total = _TOTAL.search(rest)
+    if total:
+        manual_kcal = _to_float(total.group(1))
+        kcal_type = "total"
+        rest = rest[:total.start()]
+
+    per_100 = _PER_100.search(rest)
+    if per_100:
+        if kcal_type:
+            return None  # одновременно "(X)" и "X ккал" — пусть разбирает ИИ
+        manual_kcal = _to_float(per_100.group(1))
+        kcal_type = "per_100"
+        rest = rest[:per_100.start()] + " " + rest[per_100.end():]
+
+    weights = _WEIGHT.findall(rest)
+    if len(weights) > 1:
+        return None
+    if weights:
+        value, unit = weights[0]
+        weight = _to_float(value) * UNITS[unit.lower().rstrip(".")]
+        rest = _WEIGHT.sub(" ", rest)
+    elif kcal_type == "per_100":
+        weight = 100.0
+    elif kcal_type == "total":
+        weight = 0.0
+    else:
+        return None  # ни веса, ни калорий — неуверенно
+
+    name = " ".join(rest.strip(" -–—:.").split()).lower()
+    if not name or not re.search(r"[а-яёa-z]", name):
+        return None
+    # Остатки чисел в конце названия ("яблоко 150") — скорее всего вес без единиц
+    if re.search(r"\d$", name) and not re.search(r"\d%$", name):
+        return None
+    return name, weight, manual_kcal, kcal_type
+
+
+class LocalParser:
+    """
+    Детерминированный разбор типичных сообщений без запроса к ИИ.
+    Возвращает те же кортежи, что parse_food_input, или None, если текст не укладывается в грамматику.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.fallbacks = 0
+
+    def stats(self):
+        total = self.hits + self.fallbacks
+        return {
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def parse(self, text):
+        results = self._parse(text)
+        if results:
+            self.hits += 1
+        else:
+            self.fallbacks += 1
+        return results
+
+    def _parse(self, text):
+        current_date = None
+        current_time = None
+        results = []
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+
+            # Заголовки: дата и/или время отдельной строкой ("23/01/26", "03:05", "23/01/26 03:05")
+            tokens = line.split()
+            if 1 <= len(tokens) <= 2 and all(_DATE.match(t) or _TIME.match(t) for t in tokens):
+                for token in tokens:
+                    date_match = _DATE.match(token)
+                    if date_match:
+                        current_date = _parse_date(date_match)
+                        if current_date is None:
+                            return None
+                    else:
+                        current_time = _parse_time(_TIME.match(token))
+                        if current_time is None:
+                            return None
+                continue
+
+            for segment in _SPLIT.split(line):
+                segment = segment.strip()
+                if not segment:
+                    continue
+                item = _parse_item(segment)
+                if item is None:
+                    return None
+                results.append((*item, current_date, current_time))
+
+        return results or None
+
+
+local_parser = LocalParser()
@@ -0,0 +1,64 @@
+from collections import deque
+
+LATENCY_SAMPLES = 200
+
+
+class LatencyHistogram:
+    """Скользящее окно последних замеров времени (сек) с перцентилями."""
+
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self._samples = deque(maxlen=max_samples)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, p, default=None):
+        if not self._samples:
+            return default
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self):
+        if not self._samples:
+            return {"count": 0}
+        return {
+            "count": len(self._samples),
+            "p50": round(self.percentile(50), 3),
+            "p95": round(self.percentile(95), 3),
+            "p99": round(self.percentile(99), 3),
+        }
+
+
+class LatencyByKind:
+    """
+    Отдельные окна задержек по типам запросов (разбор, поиск калорийности, первый фрагмент потока).
+    censored — замеры-нижние оценки: запрос отменили или оборвали по таймауту раньше ответа.
+    """
+
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self.max_samples = max_samples
+        self._histograms = {}
+        self.censored = {}
+
+    def __getitem__(self, kind):
+        if kind not in self._histograms:
+            self._histograms[kind] = LatencyHistogram(self.max_samples)
+        return self._histograms[kind]
+
+    def kinds(self):
+        return list(self._histograms)
+
+    def record(self, kind, seconds, censored=False):
+        self[kind].record(seconds)
+        if censored:
+            self.censored[kind] = self.censored.get(kind, 0) + 1
+
+    def summary(self):
+        return {
+            kind: {**histogram.summary(), "censored": self.censored.get(kind, 0)}
+            for kind, histogram in self._histograms.items()
+        }
@@ -0,0 +1,68 @@
+import hashlib
+import re
+from collections import OrderedDict
+from datetime import datetime
+from config import USER_TZ
+
+PARSE_CACHE_SIZE = 500
+
+# Дата без года (21.01, 21/01) — ИИ сам угадывает год, поэтому такой разбор зависит от текущего дня
+_YEARLESS_DATE = re.compile(r"(?<![\d./])\d{1,2}[./]\d{1,2}(?![\d%]|[./]\d|\s*%)")
+
+
+def normalize_text(text):
+    lines = (" ".join(line.split()) for line in text.strip().lower().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def make_key(text):
+    normalized = normalize_text(text)
+    if _YEARLESS_DATE.search(normalized):
+        normalized = f"{datetime.now(USER_TZ).date().isoformat()}\n{normalized}"
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ParseCache:
+    """
+    Кэш результатов parse_food_input по содержимому текста (LRU, в памяти процесса).
+    Хранятся кортежи (name, weight, manual_kcal, kcal_type, date, time) как вернул ИИ:
+    пустые date/time не подставляются, поэтому обработчик привязывает их к текущей дате.
+    """
+
+    def __init__(self, max_size=PARSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._lru),
+        }
+
+    def get(self, text):
+        key = make_key(text)
+        items = self._lru.get(key)
+        if items is None:
+            self.misses += 1
+            return None
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return list(items)
+
+    def put(self, text, items):
+        if not items:
+            # Пустой результат — ошибка разбора, не кэшируем
+            return
+        key = make_key(text)
+        self._lru[key] = tuple(items)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+
+parse_cache = ParseCache()
@@ -1,10 +1,9 @@
 from datetime import datetime
-import re
 
 async def generate_day_report(daily_logs):
     """
     Generates a report string from daily logs rows.
-    Rows: list of (meal_id, timestamp, product_name, weight_g, kcal_total)
+    Rows: list of LogRow (timestamp is already a datetime in USER_TZ)
     """
     if not daily_logs:
         return f"{datetime.now().strftime('%d/%m/%y')}\n\nНет данных."
@@ -16,34 +15,19 @@ async def generate_day_report(daily_logs):
     log_date_str = None
     
     for row in daily_logs:
-        log_id, meal_id, timestamp_str, name, weight, kcal = row
-        if isinstance(timestamp_str, str):
-            # Самый надежный способ - вытащить цифры через regex
-            # Ожидаем YYYY-MM-DD HH:MM:SS
-            match = re.search(r"(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2})", timestamp_str)
-            if match:
-                try:
-                    dt = datetime.strptime(f"{match.group(1)} {match.group(2)}", "%Y-%m-%d %H:%M")
-                except:
-                    dt = datetime.now()
-            else:
-                dt = datetime.now()
-        else:
-            dt = timestamp_str
-
         if log_date_str is None:
-            log_date_str = dt.strftime('%d/%m/%y')
+            log_date_str = row.timestamp.strftime('%d/%m/%y')
 
-        if meal_id not in meals:
-            meals[meal_id] = {
-                "time": dt,
+        if row.meal_id not in meals:
+            meals[row.meal_id] = {
+                "time": row.timestamp,
                 "items": [],
                 "total": 0
             }
-            order.append(meal_id)
+            order.append(row.meal_id)
         
-        meals[meal_id]["items"].append((name, weight, kcal))
-        meals[meal_id]["total"] += kcal
+        meals[row.meal_id]["items"].append((row.product_name, row.weight_g, row.kcal_total))
+        meals[row.meal_id]["total"] += row.kcal_total
 
     # Build String
     header_date = log_date_str if log_date_str else datetime.now().strftime('%d/%m/%y')
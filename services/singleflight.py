@@ -0,0 +1,50 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов: первый вызов по ключу запускает задачу,
+    остальные ждут ее же результат (или ту же ошибку).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.saved = 0
+
+    def stats(self):
+        return {"calls": self.calls, "saved": self.saved, "in_flight": len(self._inflight)}
+
+    def join(self, key):
+        """Задача, уже выполняющаяся по ключу, или None."""
+        task = self._inflight.get(key)
+        # Завершенная задача еще может числиться до своего done callback — к ней не присоединяемся
+        if task is not None and not task.done():
+            self.saved += 1
+            return task
+        return None
+
+    def start(self, key, coro):
+        """Регистрирует новую задачу по ключу."""
+        self.calls += 1
+        task = asyncio.ensure_future(coro)
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return task
+
+    async def do(self, key, factory):
+        task = self.join(key)
+        if task is None:
+            task = self.start(key, factory())
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибку забирают ожидающие; если их не осталось — не даем asyncio ругаться
+        if not task.cancelled():
+            task.exception()
+
+
+singleflight = SingleFlight()
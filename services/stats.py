@@ -0,0 +1,125 @@
+import datetime
+import time
+import numpy as np
+from database import repository
+
+# Время приема пищи: (подпись, час начала, час конца); интервал может переходить через полночь
+MEAL_SLOTS = (
+    ("Утро (5–11)", 5, 11),
+    ("День (11–16)", 11, 16),
+    ("Вечер (16–22)", 16, 22),
+    ("Ночь (22–5)", 22, 5),
+)
+ROLLING_WINDOW = 7
+TOP_PRODUCTS = 5
+
+
+async def collect_period(user_id, start, end):
+    """
+    Итоги по дням из daily_summary (ккал за день, были ли записи) и записи за период
+    в виде колонок (час, ккал, продукт) для разбивки по времени приема пищи и продуктам.
+    Строки читаются потоком из get_logs_range, без списка строк целиком.
+    """
+    n_days = (end - start).days + 1
+    daily = np.zeros(n_days, dtype=np.float64)
+    logged = np.zeros(n_days, dtype=bool)
+    for log_date, kcal_total, _, item_count in await repository.get_daily_totals(user_id, start, end):
+        offset = (datetime.date.fromisoformat(log_date) - start).days
+        daily[offset] = kcal_total or 0.0
+        logged[offset] = item_count > 0
+
+    hours, kcal, names = [], [], []
+    async for _, rows in repository.get_logs_range(user_id, start, end):
+        for log in rows:
+            hours.append(log.timestamp.hour)
+            kcal.append(log.kcal_total or 0.0)
+            names.append(log.product_name)
+    return (
+        daily,
+        logged,
+        np.array(hours, dtype=np.int32),
+        np.array(kcal, dtype=np.float64),
+        np.array(names, dtype=str),
+    )
+
+
+def compute_stats(start, end, daily, logged, hours, kcal, names, top_n=TOP_PRODUCTS):
+    """Статистика периода по колонкам из collect_period (все вычисления — векторные операции NumPy)."""
+    n_days = (end - start).days + 1
+    logged_days = int(logged.sum())
+    total = float(daily.sum())
+
+    # Скользящее среднее за ROLLING_WINDOW дней; дни без записей не тянут среднее вниз
+    window = min(ROLLING_WINDOW, n_days)
+    sums = np.convolve(daily, np.ones(window), mode="valid")
+    counts = np.convolve(logged.astype(np.float64), np.ones(window), mode="valid")
+    rolling = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+    hour_kcal = np.bincount(hours, weights=kcal, minlength=24)
+    slots = []
+    for label, begin, finish in MEAL_SLOTS:
+        part = hour_kcal[begin:finish].sum() if begin < finish else hour_kcal[begin:].sum() + hour_kcal[:finish].sum()
+        slots.append((label, float(part)))
+
+    top = []
+    if len(names):
+        products, inverse = np.unique(names, return_inverse=True)
+        product_kcal = np.bincount(inverse, weights=kcal)
+        for i in np.argsort(product_kcal)[::-1][:top_n]:
+            top.append((str(products[i]), float(product_kcal[i])))
+
+    logged_totals = np.where(logged, daily, np.nan)
+    return {
+        "start": start,
+        "end": end,
+        "days": n_days,
+        "logged_days": logged_days,
+        "items": int(len(kcal)),
+        "total": total,
+        "average": total / logged_days if logged_days else 0.0,
+        "daily": daily,
+        "rolling": rolling,
+        "max_day": (start + datetime.timedelta(days=int(np.nanargmax(logged_totals))), float(np.nanmax(logged_totals))) if logged_days else None,
+        "min_day": (start + datetime.timedelta(days=int(np.nanargmin(logged_totals))), float(np.nanmin(logged_totals))) if logged_days else None,
+        "slots": slots,
+        "top": top,
+    }
+
+
+async def period_stats(user_id, start, end):
+    """Возвращает (статистика, время расчета в мс)."""
+    started = time.perf_counter()
+    stats = compute_stats(start, end, *await collect_period(user_id, start, end))
+    return stats, (time.perf_counter() - started) * 1000
+
+
+def format_stats(title, stats, show_days=False):
+    period = f"{stats['start'].strftime('%d.%m.%y')}–{stats['end'].strftime('%d.%m.%y')}"
+    if not stats["logged_days"]:
+        return f"{title} ({period})\n\nНет данных."
+
+    text = f"{title} ({period})\n\n"
+    text += f"Всего {int(stats['total'])} ккал, дней с записями: {stats['logged_days']}/{stats['days']}\n"
+    text += f"В среднем {int(stats['average'])} ккал в день\n"
+    text += f"Среднее за последние {min(ROLLING_WINDOW, stats['days'])} дн.: {int(stats['rolling'][-1])} ккал\n"
+    max_date, max_kcal = stats["max_day"]
+    min_date, min_kcal = stats["min_day"]
+    text += f"Максимум: {max_date.strftime('%d.%m')} — {int(max_kcal)} ккал\n"
+    text += f"Минимум: {min_date.strftime('%d.%m')} — {int(min_kcal)} ккал\n"
+
+    if show_days:
+        text += "\nПо дням:\n"
+        for i, day_kcal in enumerate(stats["daily"]):
+            day = stats["start"] + datetime.timedelta(days=i)
+            text += f"{day.strftime('%d.%m')}: {int(day_kcal)} ккал\n" if day_kcal else f"{day.strftime('%d.%m')}: —\n"
+
+    text += "\nПо времени приема пищи:\n"
+    for label, slot_kcal in stats["slots"]:
+        share = slot_kcal / stats["total"] if stats["total"] else 0
+        text += f"{label}: {int(slot_kcal)} ккал ({share:.0%})\n"
+
+    text += "\nТоп продуктов по калориям:\n"
+    for i, (name, product_kcal) in enumerate(stats["top"], 1):
+        text += f"{i}. {name} — {int(product_kcal)} ккал\n"
+    return text.rstrip()
+
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import random
+import time
+from config import GOOGLE_SYNC_WORKERS
+from database import repository
+from services import google_sync
+
+
+class SyncOutbox:
+    """
+    Фоновая отправка отчетов из таблицы sync_outbox в Google Docs.
+    Отчеты одного документа уходят вместе (append_many), неудачные повторяются с экспоненциальной задержкой.
+    После max_attempts неудач запись получает статус failed и возвращается в очередь при следующей постановке.
+    """
+
+    def __init__(self, poll_interval=60.0, batch_size=50, max_attempts=8, base_delay=30.0, max_delay=3600.0):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._wake = asyncio.Event()
+        self._drain_lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self):
+        """Сигнал воркеру: в очереди появились новые отчеты."""
+        self._wake.set()
+
+    async def enqueue(self, entries):
+        """entries: список (user_id, date, doc_id, report_text). Возвращает количество поставленных в очередь."""
+        queued = await repository.enqueue_sync(entries)
+        if queued:
+            self.wake()
+        return queued
+
+    async def _run(self):
+        while True:
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Sync outbox worker error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def drain(self):
+        """Отправляет все отчеты, которым пришло время. Возвращает количество доставленных."""
+        # Один отправитель за раз, иначе запись может уйти в документ дважды
+        async with self._drain_lock:
+            return await self._drain()
+
+    async def _drain(self):
+        delivered_total = 0
+        while True:
+            entries = await repository.get_due_sync_entries(time.time(), self.batch_size)
+            if not entries:
+                return delivered_total
+
+            by_doc = {}
+            for entry in entries:
+                by_doc.setdefault(entry[1], []).append(entry)
+
+            semaphore = asyncio.Semaphore(GOOGLE_SYNC_WORKERS)
+
+            async def send(doc_id, doc_entries):
+                async with semaphore:
+                    return await google_sync.append_many(doc_id, [text for _, _, text, _ in doc_entries])
+
+            results = await asyncio.gather(*(send(doc_id, doc_entries) for doc_id, doc_entries in by_doc.items()))
+
+            delivered = []
+            retries = []
+            for doc_entries, (appended, error) in zip(by_doc.values(), results):
+                delivered.extend(entry_id for entry_id, _, _, _ in doc_entries[:appended])
+                for entry_id, _, _, attempts in doc_entries[appended:]:
+                    retries.append(self._retry(entry_id, attempts + 1, error))
+
+            await repository.finish_sync_entries(delivered, retries)
+            delivered_total += len(delivered)
+            logging.info(f"Sync outbox: {len(delivered)} delivered, {len(retries)} postponed")
+
+    def _retry(self, entry_id, attempts, error):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        delay = random.uniform(delay / 2, delay)
+        status = "failed" if attempts >= self.max_attempts else "pending"
+        if status == "failed":
+            logging.error(f"Sync outbox: entry {entry_id} failed after {attempts} attempts: {error}")
+        return entry_id, attempts, time.time() + delay, str(error), status
+
+
+sync_outbox = SyncOutbox()
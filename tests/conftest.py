@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Корень репозитория в sys.path и обязательные переменные окружения для импорта config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Пустая база во временном каталоге (seed из JSON пропускается — файла там нет)."""
+    from database import db
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db.pool, "path", str(tmp_path / "bot_database.db"))
+    monkeypatch.setattr(db.pool, "archive_path", str(tmp_path / "bot_archive.db"))
+    monkeypatch.setattr(db.pool, "archive_horizon", None)
+    return db
+
+
+@pytest.fixture
+def run_with_db(temp_db):
+    """Запуск сценария (корутинной функции) на временной базе: init_db, сценарий, close_db."""
+    def run(scenario):
+        async def wrapper():
+            await temp_db.init_db()
+            try:
+                await scenario()
+            finally:
+                await temp_db.close_db()
+        asyncio.run(wrapper())
+    return run
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+from groq import AsyncGroq
+
+
+class FakeCompletionsServer:
+    """
+    Локальный сервер chat completions в формате Groq/OpenAI (/openai/v1/chat/completions).
+
+    respond(body) -> (задержка до ответа в секундах, текст ответа) или
+    (задержка, текст, код ответа, заголовки): код не 200 — ошибка API с текстом в message,
+    заголовки (x-ratelimit-*, retry-after) добавляются к любому ответу.
+    Для stream=true текст отдается кусками по chunk_size символов с паузой chunk_delay. truncate_stream — обрыв потока
+    на этом числе символов (как при достижении max_tokens), finish_reason="length".
+    Считает запросы и одновременно выполняющиеся запросы (in_flight / max_in_flight).
+    """
+
+    def __init__(self, respond=None, chunk_size=8, chunk_delay=0.0, truncate_stream=None):
+        self.respond = respond or (lambda body: (0.0, "ok"))
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.truncate_stream = truncate_stream
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = 0
+        self._runner = None
+        self.url = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app, handler_cancellation=True)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    def client(self):
+        return AsyncGroq(api_key="test", base_url=self.url, max_retries=0)
+
+    async def _handle(self, request):
+        body = await request.json()
+        self.requests.append((time.perf_counter(), body))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay, text, status, headers = (*self.respond(body), 200, None)[:4]
+            await asyncio.sleep(delay)
+            if status != 200:
+                error = {"error": {"message": text, "type": "fake_error", "code": str(status)}}
+                return web.json_response(error, status=status, headers=headers)
+            if body.get("stream"):
+                return await self._stream(request, body, text, headers)
+            return web.json_response(_completion(body, text, "stop"), headers=headers)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request, body, text, headers=None):
+        response = web.StreamResponse(headers={**(headers or {}), "Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        limit = len(text) if self.truncate_stream is None else min(self.truncate_stream, len(text))
+        for i in range(0, limit, self.chunk_size):
+            await asyncio.sleep(self.chunk_delay)
+            piece = text[i:min(i + self.chunk_size, limit)]
+            await response.write(_sse(_chunk(body, {"content": piece}, None)))
+        finish = "stop" if limit == len(text) else "length"
+        await response.write(_sse(_chunk(body, {}, finish)))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+def _completion(body, text, finish_reason):
+    return {
+        "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+    }
+
+
+def _chunk(body, delta, finish_reason):
+    return {
+        "id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _sse(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from aiohttp import web
+from google.auth.credentials import AnonymousCredentials
+
+from services import google_sync
+
+DOC_ID = "doc123"
+
+
+class FakeDocsServer:
+    """Локальный Google Docs API: documents.get и documents.batchUpdate, запоминает тела batchUpdate."""
+
+    def __init__(self):
+        self.batches = []
+        self.gets = 0
+        self._runner = None
+        self.url = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/v1/documents/{doc_id}", self._get)
+        app.router.add_post("/v1/documents/{doc_id}:batchUpdate", self._batch_update)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+    async def _get(self, request):
+        self.gets += 1
+        return web.json_response({"documentId": request.match_info["doc_id"], "body": {"content": []}})
+
+    async def _batch_update(self, request):
+        self.batches.append((request.match_info["doc_id"], await request.json()))
+        return web.json_response({"documentId": request.match_info["doc_id"], "replies": []})
+
+
+@pytest.fixture
+def docs_client(tmp_path, monkeypatch):
+    """Клиент Docs на локальном сервере: анонимные учетные данные, свой пул потоков (кэш клиента — на поток)."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "credentials.json").write_text(json.dumps({"type": "service_account"}))
+    monkeypatch.setattr(
+        google_sync.service_account.Credentials, "from_service_account_file",
+        lambda path, scopes: AnonymousCredentials()
+    )
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(google_sync, "_executor", executor)
+    monkeypatch.setattr(google_sync, "_local", threading.local())
+    yield lambda url: monkeypatch.setattr(google_sync, "GOOGLE_DOCS_ENDPOINT", url)
+    executor.shutdown()
+
+
+def _texts(requests):
+    return [r["insertText"]["text"] for r in requests if "insertText" in r]
+
+
+def test_report_is_appended_with_one_batch_update(docs_client):
+    async def scenario():
+        async with FakeDocsServer() as server:
+            docs_client(server.url)
+            url = f"https://docs.google.com/document/d/{DOC_ID}/edit"
+            assert await google_sync.append_many(url, ["Отчет за день"]) == (1, None)
+
+            # Один batchUpdate в конец тела документа, без documents.get за его длиной
+            assert server.gets == 0 and len(server.batches) == 1
+            doc_id, body = server.batches[0]
+            assert doc_id == DOC_ID
+            assert body["requests"] == [
+                {"insertPageBreak": {"endOfSegmentLocation": {}}},
+                {"insertText": {"endOfSegmentLocation": {}, "text": "\nОтчет за день\n"}},
+            ]
+
+    asyncio.run(scenario())
+
+
+def test_many_reports_are_split_at_max_batch_chars(docs_client, monkeypatch):
+    monkeypatch.setattr(google_sync, "MAX_BATCH_CHARS", 100)
+    reports = [f"{day:02d}: " + "x" * 36 for day in range(1, 6)]  # по 40 символов
+
+    async def scenario():
+        async with FakeDocsServer() as server:
+            docs_client(server.url)
+            assert await google_sync.append_many(DOC_ID, reports) == (5, None)
+            assert server.gets == 0
+            chunks = [_texts(body["requests"]) for _, body in server.batches]
+            assert chunks == [[f"\n{r}\n" for r in part] for part in (reports[0:2], reports[2:4], reports[4:])]
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import asyncio
+
+from services import groq_ai
+from services.llm_dispatcher import LLMDispatcher
+from services.llm_providers import GroqProvider, HedgedLLM
+from services.parse_cache import ParseCache
+from tests.fake_llm import FakeCompletionsServer
+from tests.test_stream_parse import ANSWER, TEXT
+
+MESSAGES = [{"role": "user", "content": "Калорийность: гречка"}]
+HEDGE_DELAY = 0.2
+
+
+def _provider(server):
+    dispatcher = LLMDispatcher("test", max_concurrency=4, timeout=5, max_retries=0)
+    return GroqProvider(server.client(), "test-model", dispatcher)
+
+
+def _hedged(slow, fast):
+    """Основной провайдер — slow, резервный — fast; задержка до дубля HEDGE_DELAY, пока нет замеров."""
+    return HedgedLLM([_provider(slow), _provider(fast)], hedge_percentile=95, default_delay=HEDGE_DELAY)
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (2.0, "110")) as slow, \
+                FakeCompletionsServer(respond=lambda body: (0.05, "120")) as fast:
+            llm = _hedged(slow, fast)
+            assert await llm.complete(MESSAGES, 0, 10, kind="lookup") == "120"
+            assert (llm.hedged, llm.hedge_wins) == (1, 1)
+            await asyncio.sleep(0.1)
+            assert slow.cancelled == 1 and len(fast.requests) == 1
+
+            # Отмененный запрос записан как нижняя оценка, а не потерян
+            latency = llm.primary.latency
+            assert latency.censored == {"lookup": 1}
+            assert latency["lookup"].percentile(50) >= HEDGE_DELAY
+
+    asyncio.run(scenario())
+
+
+def test_fast_primary_is_not_hedged():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0.02, "110")) as primary, \
+                FakeCompletionsServer(respond=lambda body: (0.02, "120")) as backup:
+            llm = _hedged(primary, backup)
+            assert await llm.complete(MESSAGES, 0, 10, kind="lookup") == "110"
+            assert llm.hedged == 0 and backup.requests == []
+            assert llm.primary.latency.censored == {}
+
+    asyncio.run(scenario())
+
+
+def test_hedge_delay_is_per_kind():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0, "110")) as primary, \
+                FakeCompletionsServer() as backup:
+            llm = HedgedLLM([_provider(primary), _provider(backup)], 95, default_delay=5, min_delay=0, min_samples=3)
+            for _ in range(3):
+                await llm.complete(MESSAGES, 0, 10, kind="lookup")
+            for seconds in (1.0, 1.5, 2.0):
+                llm.primary.latency.record("parse", seconds)
+            assert llm.hedge_delay("lookup") < 0.5
+            assert llm.hedge_delay("parse") == 2.0
+            # Для типа без замеров — задержка по умолчанию
+            assert llm.hedge_delay("parse_stream") == 5
+
+    asyncio.run(scenario())
+
+
+def test_streamed_parse_is_hedged_on_first_token(monkeypatch):
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (2.0, ANSWER)) as slow, \
+                FakeCompletionsServer(respond=lambda body: (0.05, ANSWER)) as fast:
+            llm = _hedged(slow, fast)
+            monkeypatch.setattr(groq_ai, "llm", llm)
+            monkeypatch.setattr(groq_ai, "parse_cache", ParseCache())
+            items = [item async for item in groq_ai.stream_food_input(TEXT)]
+            assert [item[0] for item in items] == ["драконфрукт", "манго"]
+            assert (llm.hedged, llm.hedge_wins) == (1, 1)
+            await asyncio.sleep(0.1)
+            assert slow.cancelled == 1
+            assert [body.get("stream") for _, body in fast.requests] == [True]
+            assert llm.primary.latency.censored == {"parse_stream": 1}
+            assert len(llm.providers[1].latency["parse_stream"]) == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+
+from services.llm_dispatcher import LLMDispatcher
+from services.llm_providers import GroqProvider
+from tests.fake_llm import FakeCompletionsServer
+
+LATENCY = 0.3
+MESSAGES = [{"role": "user", "content": "Калорийность: гречка"}]
+
+
+async def _run_users(users, max_concurrency, timeout=5.0):
+    """users одновременных запросов через провайдер и диспетчер, как в services.groq_ai."""
+    async with FakeCompletionsServer(respond=lambda body: (LATENCY, "110")) as server:
+        dispatcher = LLMDispatcher("test", max_concurrency=max_concurrency, timeout=timeout, max_retries=0)
+        provider = GroqProvider(server.client(), "test-model", dispatcher)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(provider.complete(MESSAGES, 0, 10) for _ in range(users)))
+        return results, time.perf_counter() - started, server, dispatcher
+
+
+def test_concurrent_users_overlap():
+    results, elapsed, server, _ = asyncio.run(_run_users(users=8, max_concurrency=8))
+    assert results == ["110"] * 8
+    # Все запросы выполнялись одновременно, а не друг за другом (8 * LATENCY)
+    assert server.max_in_flight == 8
+    assert elapsed < LATENCY * 3
+
+
+def test_semaphore_caps_in_flight_calls():
+    results, elapsed, server, dispatcher = asyncio.run(_run_users(users=6, max_concurrency=2))
+    assert results == ["110"] * 6
+    assert server.max_in_flight == 2
+    # 6 запросов по 2 одновременно — три волны
+    assert elapsed >= LATENCY * 3 * 0.9
+    assert dispatcher.active == 0 and dispatcher.queue_depth == 0
+
+
+def test_timeout_cancels_request_and_frees_slot():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (2.0, "110")) as server:
+            dispatcher = LLMDispatcher("test", max_concurrency=1, timeout=0.2, max_retries=0)
+            provider = GroqProvider(server.client(), "test-model", dispatcher)
+            started = time.perf_counter()
+            with pytest.raises(asyncio.TimeoutError):
+                await provider.complete(MESSAGES, 0, 10)
+            assert time.perf_counter() - started < 1.0
+            # HTTP-запрос оборван, слот семафора освобожден
+            await asyncio.sleep(0.1)
+            assert server.cancelled == 1 and server.in_flight == 0
+            assert dispatcher.active == 0
+
+    asyncio.run(scenario())
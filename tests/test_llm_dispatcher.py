@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from services.llm_dispatcher import CircuitOpenError, LLMDispatcher
+from services.llm_providers import GroqProvider
+from tests.fake_llm import FakeCompletionsServer
+
+MESSAGES = [{"role": "user", "content": "Калорийность: гречка"}]
+
+
+def _replies(*replies):
+    """respond для FakeCompletionsServer: ответы по очереди, последний повторяется."""
+    queue = list(replies)
+    return lambda body: queue.pop(0) if len(queue) > 1 else queue[0]
+
+
+def _gaps(server):
+    times = [started for started, _ in server.requests]
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def _provider(server, **options):
+    options = {"max_concurrency": 4, "timeout": 5, "max_retries": 0, **options}
+    dispatcher = LLMDispatcher("test", **options)
+    return GroqProvider(server.client(), "test-model", dispatcher), dispatcher
+
+
+def test_429_is_retried_after_retry_after():
+    async def scenario():
+        replies = _replies((0, "slow down", 429, {"retry-after": "0.4"}), (0, "110"))
+        async with FakeCompletionsServer(respond=replies) as server:
+            provider, dispatcher = _provider(server, max_retries=2, base_delay=0.01)
+            assert await provider.complete(MESSAGES, 0, 10) == "110"
+            assert len(server.requests) == 2 and _gaps(server)[0] >= 0.4
+            assert (dispatcher.retries, dispatcher.throttled) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_server_errors_back_off_exponentially_and_client_errors_are_not_retried():
+    async def scenario():
+        replies = _replies((0, "oops", 500, None), (0, "oops", 500, None), (0, "110"))
+        async with FakeCompletionsServer(respond=replies) as server:
+            provider, dispatcher = _provider(server, max_retries=3, base_delay=0.2)
+            assert await provider.complete(MESSAGES, 0, 10) == "110"
+            first, second = _gaps(server)
+            # Задержка попытки n — случайная в [base * 2^n / 2, base * 2^n]
+            assert 0.1 <= first < 0.3 and 0.2 <= second < 0.5
+            assert dispatcher.retries == 2 and dispatcher.consecutive_failures == 0
+
+        async with FakeCompletionsServer(respond=lambda body: (0, "bad request", 400, None)) as server:
+            provider, dispatcher = _provider(server, max_retries=3, base_delay=0.01)
+            with pytest.raises(Exception) as error:
+                await provider.complete(MESSAGES, 0, 10)
+            assert error.value.status_code == 400
+            assert len(server.requests) == 1 and dispatcher.retries == 0
+
+    asyncio.run(scenario())
+
+
+def test_waits_while_request_budget_is_exhausted():
+    async def scenario():
+        headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "0.4s"}
+        async with FakeCompletionsServer(respond=lambda body: (0, "110", 200, headers)) as server:
+            provider, dispatcher = _provider(server)
+            await provider.complete(MESSAGES, 0, 10)
+            assert dispatcher.remaining_requests == 0
+            await provider.complete(MESSAGES, 0, 10)
+            assert _gaps(server)[0] >= 0.35 and dispatcher.throttled == 1
+
+    asyncio.run(scenario())
+
+
+def test_waits_while_token_budget_is_exhausted():
+    async def scenario():
+        headers = {"x-ratelimit-remaining-tokens": "100", "x-ratelimit-reset-tokens": "400ms"}
+        async with FakeCompletionsServer(respond=lambda body: (0, "110", 200, headers)) as server:
+            provider, dispatcher = _provider(server)
+            await provider.complete(MESSAGES, 0, 10)
+            # Запрос укладывается в остаток токенов — без ожидания
+            await provider.complete(MESSAGES, 0, 10)
+            # Не укладывается — ждем сброса окна
+            await provider.complete(MESSAGES, 0, 500)
+            small, large = _gaps(server)
+            assert small < 0.2 and large >= 0.35 and dispatcher.throttled == 1
+
+    asyncio.run(scenario())
+
+
+def test_circuit_opens_half_opens_and_closes():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0, "oops", 503, None)) as server:
+            provider, dispatcher = _provider(server, failure_threshold=2, reset_timeout=0.3)
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    await provider.complete(MESSAGES, 0, 10)
+            assert dispatcher.is_open and dispatcher.stats()["circuit"] == "open"
+
+            # Открыт — запрос отклоняется без обращения к API
+            with pytest.raises(CircuitOpenError):
+                await provider.complete(MESSAGES, 0, 10)
+            assert len(server.requests) == 2 and dispatcher.rejected == 1
+
+            # Half-open: неудачный пробный запрос снова открывает circuit
+            await asyncio.sleep(0.35)
+            assert dispatcher.stats()["circuit"] == "half-open"
+            with pytest.raises(Exception):
+                await provider.complete(MESSAGES, 0, 10)
+            assert dispatcher.is_open and len(server.requests) == 3
+
+            # Удачный пробный запрос закрывает; пока он идет, остальные отклоняются
+            await asyncio.sleep(0.35)
+            server.respond = lambda body: (0.2, "110")
+            trial = asyncio.create_task(provider.complete(MESSAGES, 0, 10))
+            await asyncio.sleep(0.05)
+            with pytest.raises(CircuitOpenError):
+                await provider.complete(MESSAGES, 0, 10)
+            assert await trial == "110"
+            assert dispatcher.stats()["circuit"] == "closed" and dispatcher.consecutive_failures == 0
+            assert await provider.complete(MESSAGES, 0, 10) == "110"
+
+    asyncio.run(scenario())
+
+
+def test_queue_depth_reports_waiting_calls():
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0.3, "110")) as server:
+            provider, dispatcher = _provider(server, max_concurrency=1)
+            calls = [asyncio.create_task(provider.complete(MESSAGES, 0, 10)) for _ in range(3)]
+            await asyncio.sleep(0.1)
+            assert (dispatcher.queue_depth, dispatcher.active) == (2, 1)
+            await asyncio.sleep(0.3)
+            assert (dispatcher.queue_depth, dispatcher.active) == (1, 1)
+            assert await asyncio.gather(*calls) == ["110"] * 3
+            assert dispatcher.stats()["queue_depth"] == 0 and dispatcher.active == 0
+
+    asyncio.run(scenario())
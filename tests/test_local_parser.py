@@ -0,0 +1,15 @@
+from services.local_parser import LocalParser
+
+
+def test_date_header_is_parsed():
+    items = LocalParser().parse("23/01/26 13:05\nЯблоко 150г")
+    assert items == [("яблоко", 150.0, None, None, "2026-01-23", "13:05")]
+
+
+def test_impossible_date_falls_through_to_llm():
+    parser = LocalParser()
+    for header in ("31/02/26", "29/02/25", "31/04/2026", "00/01/26"):
+        assert parser.parse(f"{header}\nЯблоко 150г") is None, header
+    assert parser.stats()["fallbacks"] == 4
+    # 29 февраля високосного года — настоящая дата
+    assert parser.parse("29/02/24\nЯблоко 150г")[0][4] == "2024-02-29"
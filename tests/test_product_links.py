@@ -0,0 +1,107 @@
+import datetime
+import sqlite3
+
+from config import USER_TZ
+from database import db, repository
+
+NOW = datetime.datetime.now(USER_TZ).replace(microsecond=0)
+
+
+async def _logs():
+    async with db.pool.reader() as conn:
+        async with conn.execute(
+            "SELECT product_name, kcal_total, product_id, kcal_source FROM daily_logs ORDER BY id"
+        ) as cursor:
+            return {row[0]: tuple(row[1:]) for row in await cursor.fetchall()}
+
+
+async def _product_id(name):
+    return (await repository.get_product(name))[0]
+
+
+def test_only_catalog_rows_are_linked_and_recalculated(run_with_db):
+    async def scenario():
+        await repository.add_products([("сыр", 350)])
+        cheese = await _product_id("сыр")
+        await repository.write_meal_batch(1, [{
+            "meal_id": "m1", "timestamp": NOW, "create": True, "overwrite": False, "items": [
+                ("сыр", 100, 350.0, cheese, "catalog"),
+                ("сырники", 200, 440.0, None, "ai"),
+                ("яблоко", 150, 300.0, None, "manual"),
+                ("манго", 200, 120.0, None, "ai"),
+            ],
+        }])
+
+        # Сохранение продуктов не трогает ручную запись и оценку ИИ с другой калорийностью
+        await repository.add_products([("яблоко", 200), ("манго", 60), ("сырники", 300)])
+        logs = await _logs()
+        assert logs["яблоко"] == (300.0, None, "manual")
+        assert logs["сырники"] == (440.0, None, "ai")
+        assert logs["манго"] == (120.0, await _product_id("манго"), "catalog")
+
+        await repository.add_products([("сыр", 400)])
+        assert await repository.recalculate_product_logs(cheese) == 1
+        logs = await _logs()
+        assert logs["сыр"][0] == 400.0
+        assert logs["сырники"][0] == 440.0
+
+    run_with_db(scenario)
+
+
+def test_manual_kcal_edit_unlinks_entry(run_with_db):
+    async def scenario():
+        await repository.add_products([("гречка", 110)])
+        buckwheat = await _product_id("гречка")
+        await repository.create_meal("m1", 1, timestamp=NOW)
+        await repository.add_log(1, "m1", "гречка", 200, 220.0, NOW, product_id=buckwheat, kcal_source="catalog")
+        log_id = (await repository.get_daily_logs(1, NOW.date()))[0].id
+
+        await repository.update_log_entry(log_id, weight=100, kcal=110.0)
+        assert (await _logs())["гречка"] == (110.0, buckwheat, "catalog")
+
+        await repository.update_log_entry(log_id, kcal=500.0)
+        assert (await _logs())["гречка"] == (500.0, None, "manual")
+        await repository.add_products([("гречка", 120)])
+        assert await repository.recalculate_product_logs(buckwheat) == 0
+
+    run_with_db(scenario)
+
+
+def test_migration_relinks_only_exact_matches_with_catalog_kcal(run_with_db, tmp_path):
+    run_with_db(lambda: repository.add_products([("сыр", 350), ("яблоко", 52), ("зеленое яблоко", 40)]))
+
+    # База в состоянии схемы 8: ссылки проставлены поиском с подстроками
+    path = tmp_path / "bot_database.db"
+    conn = sqlite3.connect(path)
+    ids = dict(conn.execute("SELECT name, id FROM products"))
+    conn.execute("ALTER TABLE daily_logs DROP COLUMN kcal_source")
+    conn.executemany(
+        "INSERT INTO daily_logs (user_id, meal_id, product_name, weight_g, kcal_total, timestamp, log_date, product_id) "
+        "VALUES (1, 'm1', ?, ?, ?, 0, '2024-01-01', ?)",
+        [
+            ("сырники", 200, 440.0, ids["сыр"]),           # подстрока
+            ("Яблоко", 150, 78.0, ids["яблоко"]),           # точное совпадение, ккал по справочнику
+            ("яблоко", 100, 300.0, ids["яблоко"]),          # введено вручную
+            ("яблоко зеленое", 100, 40.0, None),            # те же слова
+        ],
+    )
+    conn.execute("PRAGMA user_version = 8")
+    conn.commit()
+    conn.close()
+    sqlite3.connect(tmp_path / "bot_archive.db").execute("ALTER TABLE daily_logs DROP COLUMN kcal_source").connection.close()
+
+    async def scenario():
+        async with db.pool.reader() as reader:
+            async with reader.execute(
+                "SELECT product_name, kcal_total, product_id, kcal_source FROM daily_logs ORDER BY id"
+            ) as cursor:
+                rows = [tuple(row) for row in await cursor.fetchall()]
+        assert rows == [
+            ("сырники", 440.0, None, None),
+            ("Яблоко", 78.0, ids["яблоко"], "catalog"),
+            ("яблоко", 300.0, None, None),
+            ("яблоко зеленое", 40.0, ids["зеленое яблоко"], "catalog"),
+        ]
+        assert await repository.recalculate_product_logs(ids["сыр"]) == 0
+
+    run_with_db(scenario)
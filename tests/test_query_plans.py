@@ -0,0 +1,74 @@
+import datetime
+
+from config import USER_TZ
+from database import db, repository
+
+
+async def _traced(call):
+    """Выполняет корутину и возвращает SQL, который она отправила в SQLite (с подставленными параметрами)."""
+    statements = []
+    connections = [db.pool._writer, *db.pool._all_readers]
+    for conn in connections:
+        await conn.set_trace_callback(statements.append)
+    try:
+        await call
+    finally:
+        for conn in connections:
+            await conn.set_trace_callback(None)
+    return statements
+
+
+async def _plan(statement):
+    async with db.pool.writer() as conn:
+        async with conn.execute(f"EXPLAIN QUERY PLAN {statement}") as cursor:
+            return " | ".join(row[3] for row in await cursor.fetchall())
+
+
+def _searches_by_user_and_date(plan):
+    """Поиск по индексу с обоими условиями user_id и log_date (годится любой из двух индексов daily_logs)."""
+    return (
+        "SEARCH daily_logs USING" in plan and "INDEX" in plan
+        and "user_id=?" in plan and "log_date=?" in plan
+    )
+
+
+def test_migrations_reach_latest_version(run_with_db):
+    async def scenario():
+        async with db.pool.reader() as conn:
+            assert await db.get_schema_version(conn) == db.MIGRATIONS[-1][0]
+
+    run_with_db(scenario)
+
+
+def test_get_daily_logs_uses_user_date_index(run_with_db):
+    async def scenario():
+        today = datetime.datetime.now(USER_TZ).date()
+        statements = await _traced(repository.get_daily_logs(1, today))
+        plans = [await _plan(s) for s in statements if "FROM daily_logs" in " ".join(s.split())]
+        assert plans and all(_searches_by_user_and_date(p) for p in plans), plans
+
+    run_with_db(scenario)
+
+
+def test_delete_daily_logs_uses_indexes(run_with_db):
+    async def scenario():
+        now = datetime.datetime.now(USER_TZ)
+        await repository.write_meal_batch(1, [
+            {"meal_id": "m1", "timestamp": now, "create": True, "overwrite": False, "items": [("гречка", 100, 110.0, None, "ai")]},
+        ])
+
+        statements = await _traced(repository.delete_daily_logs(1, now.date()))
+        logs_plans = [await _plan(s) for s in statements if s.lstrip().upper().startswith("DELETE FROM DAILY_LOGS")]
+        meals_plans = [await _plan(s) for s in statements if s.lstrip().upper().startswith("DELETE FROM MEALS")]
+
+        assert logs_plans and all(_searches_by_user_and_date(p) for p in logs_plans), logs_plans
+        # Диапазон created_at по индексу (user_id, created_at), без полного прохода по meals;
+        # проверка внешнего ключа daily_logs.meal_id — тоже по индексу
+        assert meals_plans and all(
+            "INDEX idx_meals_user_created (user_id=? AND created_at>? AND created_at<?)" in p
+            and "SCAN" not in p
+            for p in meals_plans
+        ), meals_plans
+        assert await repository.get_daily_logs(1, now.date()) == []
+
+    run_with_db(scenario)
@@ -0,0 +1,68 @@
+import datetime
+import random
+
+import pytest
+
+from config import USER_TZ
+from database import repository
+from services import stats
+
+YEAR_START = datetime.date(2025, 1, 1)
+YEAR_END = YEAR_START + datetime.timedelta(days=364)
+ITEMS_PER_DAY = 15
+# Ограничение времени /month и /week на году истории (с запасом для медленных машин)
+PERIOD_STATS_LIMIT_MS = 100
+
+
+async def _seed_year(user_id=1):
+    """Год истории: ITEMS_PER_DAY записей в день, три приема пищи, одна транзакция."""
+    rng = random.Random(0)
+    groups = []
+    for offset in range(365):
+        day = YEAR_START + datetime.timedelta(days=offset)
+        for hour in (8, 13, 19):
+            groups.append({
+                "meal_id": f"{day}-{hour}",
+                "timestamp": datetime.datetime.combine(day, datetime.time(hour), tzinfo=USER_TZ),
+                "create": True,
+                "overwrite": False,
+                "items": [
+                    (f"продукт {rng.randrange(300)}", 100, float(rng.randrange(10, 600)), None, "manual")
+                    for _ in range(ITEMS_PER_DAY // 3)
+                ],
+            })
+    await repository.write_meal_batch(user_id, groups)
+    return groups
+
+
+def test_period_stats_matches_logs(run_with_db):
+    async def scenario():
+        groups = await _seed_year()
+        start, end = YEAR_START + datetime.timedelta(days=30), YEAR_START + datetime.timedelta(days=36)
+        result, _ = await stats.period_stats(1, start, end)
+
+        expected = {}
+        for group in groups:
+            day = group["timestamp"].date()
+            if start <= day <= end:
+                expected[day] = expected.get(day, 0.0) + sum(item[2] for item in group["items"])
+        assert list(result["daily"]) == [expected[start + datetime.timedelta(days=i)] for i in range(7)]
+        assert result["logged_days"] == 7 and result["items"] == 7 * ITEMS_PER_DAY
+        assert result["total"] == pytest.approx(sum(expected.values()))
+        # Все приемы пищи в 8, 13 и 19 часов — ночью ничего
+        assert [kcal for _, kcal in result["slots"]][3] == 0
+        assert sum(kcal for _, kcal in result["slots"]) == pytest.approx(result["total"])
+
+    run_with_db(scenario)
+
+
+def test_period_stats_on_a_year_of_history_is_fast(run_with_db):
+    async def scenario():
+        await _seed_year()
+        # Полный путь: daily_summary + get_logs_range -> LogRow -> NumPy; лучший из нескольких запусков
+        timings = [(await stats.period_stats(1, YEAR_START, YEAR_END))[1] for _ in range(3)]
+        result, _ = await stats.period_stats(1, YEAR_START, YEAR_END)
+        assert result["items"] == 365 * ITEMS_PER_DAY and result["logged_days"] == 365
+        assert min(timings) < PERIOD_STATS_LIMIT_MS, timings
+
+    run_with_db(scenario)
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from services import groq_ai
+from services.llm_dispatcher import LLMDispatcher
+from services.llm_providers import GroqProvider, HedgedLLM
+from services.parse_cache import ParseCache
+from tests.fake_llm import FakeCompletionsServer
+
+TEXT = "на обед был драконфрукт, а потом еще манго"
+ANSWER = "```json\n" + json.dumps([
+    {"name": "драконфрукт", "weight": 0, "manual_kcal": 300, "kcal_type": "total", "date": None, "time": None},
+    {"name": "манго", "weight": 0, "manual_kcal": 120, "kcal_type": "total", "date": None, "time": None},
+], ensure_ascii=False) + "\n```"
+# Поток обрывается посреди второго элемента (как при достижении max_tokens)
+CUT_AT = ANSWER.index('"манго"') + 10
+
+
+def _use_server(monkeypatch, server):
+    """Направляет services.groq_ai (поток и обычные запросы) на локальный сервер, кэш разборов — пустой."""
+    client = server.client()
+    dispatcher = LLMDispatcher("test", max_concurrency=4, timeout=5, max_retries=0)
+    monkeypatch.setattr(groq_ai, "client", client)
+    monkeypatch.setattr(groq_ai, "dispatcher", dispatcher)
+    monkeypatch.setattr(groq_ai, "llm", HedgedLLM([GroqProvider(client, groq_ai.MODEL_NAME, dispatcher)], 95, 5))
+    cache = ParseCache()
+    monkeypatch.setattr(groq_ai, "parse_cache", cache)
+    return cache
+
+
+async def _collect(text):
+    return [item async for item in groq_ai.stream_food_input(text)]
+
+
+def test_truncated_stream_raises_and_is_not_cached(monkeypatch):
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0, ANSWER), truncate_stream=CUT_AT) as server:
+            cache = _use_server(monkeypatch, server)
+            with pytest.raises(ValueError, match="closing"):
+                await _collect(TEXT)
+            assert cache.get(TEXT) is None
+
+    asyncio.run(scenario())
+
+
+def test_complete_stream_is_cached(monkeypatch):
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0, ANSWER)) as server:
+            cache = _use_server(monkeypatch, server)
+            items = await _collect(TEXT)
+            assert [item[0] for item in items] == ["драконфрукт", "манго"]
+            assert cache.get(TEXT) == items
+
+    asyncio.run(scenario())
+
+
+def test_prefetch_falls_back_to_full_parse_on_truncated_stream(monkeypatch):
+    from handlers.food_log import parse_with_prefetch
+
+    async def scenario():
+        # Поток обрывается, обычный (не потоковый) ответ приходит целиком
+        async with FakeCompletionsServer(respond=lambda body: (0, ANSWER), truncate_stream=CUT_AT) as server:
+            _use_server(monkeypatch, server)
+            items, ai_kcal = await parse_with_prefetch(TEXT)
+            assert [item[0] for item in items] == ["драконфрукт", "манго"]
+            assert ai_kcal == {}
+            assert [body.get("stream", False) for _, body in server.requests] == [True, False]
+
+    asyncio.run(scenario())
+
+
+def test_identical_parses_share_one_request(monkeypatch):
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0.2, ANSWER)) as server:
+            _use_server(monkeypatch, server)
+            streamed, other_stream, blocking = await asyncio.gather(
+                _collect(TEXT), _collect(TEXT), groq_ai.parse_food_input(TEXT)
+            )
+            assert streamed == other_stream == blocking
+            assert [item[0] for item in streamed] == ["драконфрукт", "манго"]
+            assert len(server.requests) == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiters_of_failed_stream_fall_back_together(monkeypatch):
+    from handlers.food_log import parse_with_prefetch
+
+    async def scenario():
+        async with FakeCompletionsServer(respond=lambda body: (0.2, ANSWER), truncate_stream=CUT_AT) as server:
+            _use_server(monkeypatch, server)
+            results = await asyncio.gather(*(parse_with_prefetch(TEXT) for _ in range(3)))
+            for items, _ in results:
+                assert [item[0] for item in items] == ["драконфрукт", "манго"]
+            # Один оборванный поток и один общий обычный запрос вместо трех пар
+            assert [body.get("stream", False) for _, body in server.requests] == [True, False]
+
+    asyncio.run(scenario())
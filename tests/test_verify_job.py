@@ -0,0 +1,68 @@
+from database import repository
+from services import groq_ai
+from utils import scheduler
+
+
+async def _last_verified():
+    return {name: verified for name, verified in await _products("SELECT name, last_verified FROM products")}
+
+
+async def _products(sql):
+    from database import db
+
+    async with db.pool.reader() as conn:
+        async with conn.execute(sql) as cursor:
+            return await cursor.fetchall()
+
+
+def test_unanswered_products_stay_unverified(run_with_db, monkeypatch):
+    answers = {"гречка": 110, "рис": 200}
+    asked = []
+
+    async def fake_batch(names, refresh=False):
+        asked.extend(names)
+        return {name: answers.get(name) for name in names}
+
+    monkeypatch.setattr(groq_ai, "get_calories_info_batch", fake_batch)
+
+    async def scenario():
+        await repository.add_products([("гречка", 110), ("рис", 130), ("драконфрукт", 60)])
+        before = await _last_verified()
+        await scheduler.verify_calories_job()
+        after = await _last_verified()
+        assert [name for name in before if after[name] != before[name]] == ["гречка", "рис"]
+        # Пропущенный продукт спрошен один раз за проход, проход завершен, расхождение записано
+        assert sorted(asked) == ["гречка", "драконфрукт", "рис"]
+        assert await repository.get_job_state(scheduler.VERIFY_JOB) is None
+        assert await _products("SELECT name, suggested_kcal FROM product_review") == [("рис", 200)]
+
+        # Следующий проход спрашивает его снова
+        asked.clear()
+        await scheduler.verify_calories_job()
+        assert "драконфрукт" in asked
+
+    run_with_db(scenario)
+
+
+def test_batch_without_answers_pauses_pass(run_with_db, monkeypatch):
+    async def fake_batch(names, refresh=False):
+        return {name: None for name in names}
+
+    monkeypatch.setattr(groq_ai, "get_calories_info_batch", fake_batch)
+
+    async def scenario():
+        await repository.add_products([("гречка", 110), ("рис", 130)])
+        before = await _last_verified()
+        await scheduler.verify_calories_job()
+        assert await _last_verified() == before
+        # Проход не закончен — после перезапуска он продолжится сразу, а не через неделю
+        assert await repository.get_job_state(scheduler.VERIFY_JOB) is not None
+
+        monkeypatch.setattr(scheduler.scheduler, "start", lambda: None)
+        scheduler.scheduler.remove_all_jobs()
+        await scheduler.start_scheduler()
+        triggers = {type(job.trigger).__name__ for job in scheduler.scheduler.get_jobs() if job.func is scheduler.verify_calories_job}
+        scheduler.scheduler.remove_all_jobs()
+        assert triggers == {"IntervalTrigger", "DateTrigger"}
+
+    run_with_db(scenario)
@@ -0,0 +1,31 @@
+import logging
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+from database import repository
+from services import report
+
+# Отчет редактируется, только если он среди последних сообщений чата (иначе обновление не будет видно)
+LIVE_REPORT_WINDOW = 6
+
+async def show_day_report(message: types.Message, user_id, date):
+    """
+    Показывает отчет за день: редактирует последнее сообщение с отчетом за эту дату,
+    а если его нет, оно давно ушло вверх или редактирование не удалось — отправляет новое и запоминает его.
+    """
+    logs = await repository.get_daily_logs(user_id, date)
+    report_text = await report.generate_day_report(logs)
+
+    report_id = await repository.get_day_report_message_id(user_id, date)
+    if report_id and message.message_id - report_id <= LIVE_REPORT_WINDOW:
+        try:
+            await message.bot.edit_message_text(report_text, chat_id=message.chat.id, message_id=report_id)
+            return report_id
+        except TelegramBadRequest as e:
+            # Текст не изменился — отчет и так актуален
+            if "message is not modified" in str(e):
+                return report_id
+            logging.info(f"Live report {report_id} not editable ({e}), sending a new one")
+
+    sent = await message.answer(report_text)
+    await repository.set_day_report_message_id(user_id, date, sent.message_id)
+    return sent.message_id
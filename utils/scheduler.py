@@ -1,81 +1,179 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from services import groq_ai as ai_service, report, google_sync
+from services import groq_ai as ai_service, report
+from services.sync_outbox import sync_outbox
 from database import db, repository
-from config import USER_TZ
-import aiosqlite
+from config import USER_TZ, ARCHIVE_AFTER_DAYS
 from datetime import datetime, timedelta
 import pytz
 import os
+import asyncio
+import logging
+import time
 
 # Инициализируем планировщик с часовым поясом GMT+5
 scheduler = AsyncIOScheduler(timezone=pytz.timezone("Asia/Yekaterinburg"))
 
+# Проверка справочника: продуктов на транзакцию, продуктов в одном запросе к ИИ,
+# параллельных запросов к ИИ (остальная емкость остается пользователям), допуск в ккал/100г
+VERIFY_JOB = "verify_calories"
+VERIFY_BATCH_SIZE = 50
+VERIFY_LOOKUP_SIZE = 10
+VERIFY_CONCURRENCY = 2
+VERIFY_TOLERANCE = 20
+# Незаконченный проход после перезапуска продолжается через столько секунд после старта
+VERIFY_RESUME_DELAY = 60
+
+# Обслуживание базы: в тихие часы, после ночной синхронизации
+MAINTENANCE_HOUR = 4
+
 async def verify_calories_job():
-    # Helper to check products
-    # In real app, we might check only old entries or unverified ones.
-    print("Running weekly verification (skeleton)...")
-    
-    # 1. Get products
-    async with aiosqlite.connect(db.DB_PATH) as conn:
-        async with conn.execute("SELECT id, name, kcal_per_100g FROM products") as cursor:
-            products = await cursor.fetchall()
-            
-    # 2. Iterate (limit for MVP/Demo)
-    for pid, name, current_kcal in products[:5]: 
-        print(f"Checking {name}...")
-        # Check with AI
-        new_kcal = await ai_service.get_calories_info(name)
-        
-        # 3. Compare logic
-        if new_kcal > 0 and abs(new_kcal - current_kcal) > 20:
-            print(f"Discrepancy for {name}: DB={current_kcal}, AI={new_kcal}")
-            # Here we would notify user. For skeleton: just log or update 'last_verified'
-        
-        # Update last_verified
-        async with aiosqlite.connect(db.DB_PATH) as conn:
-             await conn.execute("UPDATE products SET last_verified = ? WHERE id = ?", (datetime.now(), pid))
-             await conn.commit()
+    """
+    Сверяет калорийность справочника с ИИ: сначала никогда не проверенные, затем самые давние.
+    Каждая пачка сохраняется одной транзакцией, расхождения пишутся в product_review.
+    Начало прохода хранится в job_state, поэтому после перезапуска проверка продолжается с того же места.
+    Продукты без ответа ИИ не отмечаются проверенными: они пропускаются до конца прохода и попадут в следующий.
+    """
+    started = await repository.get_job_state(VERIFY_JOB)
+    if started is None:
+        started = datetime.now(USER_TZ).isoformat(sep=" ")
+        await repository.set_job_state(VERIFY_JOB, started)
+        logging.info("Verification: starting new pass")
+    else:
+        logging.info(f"Verification: resuming pass started at {started}")
+
+    semaphore = asyncio.Semaphore(VERIFY_CONCURRENCY)
+
+    async def lookup(names):
+        async with semaphore:
+            return await ai_service.get_calories_info_batch(names, refresh=True)
+
+    checked = flagged = 0
+    skipped = set()
+    while True:
+        products = await repository.get_products_to_verify(started, VERIFY_BATCH_SIZE, exclude=skipped)
+        if not products:
+            break
+
+        names = [name for _, name, _ in products]
+        chunks = [names[i:i + VERIFY_LOOKUP_SIZE] for i in range(0, len(names), VERIFY_LOOKUP_SIZE)]
+        ai_kcal = {}
+        for result in await asyncio.gather(*(lookup(chunk) for chunk in chunks)):
+            ai_kcal.update(result)
+
+        if ai_service.llm.is_open:
+            # ИИ недоступен — не отмечаем пачку проверенной, продолжим в следующий запуск
+            logging.warning(f"Verification: LLM unavailable, pausing after {checked} products")
+            return
+
+        answered = [(pid, name, current_kcal) for pid, name, current_kcal in products if ai_kcal.get(name) is not None]
+        if not answered:
+            # Ни одного ответа (400/401, неразборчивые ответы) — circuit breaker при этом не открывается
+            logging.warning(f"Verification: no answers for a batch of {len(products)}, pausing after {checked} products")
+            return
+
+        reviews = []
+        for pid, name, current_kcal in answered:
+            new_kcal = ai_kcal[name]
+            if current_kcal is not None and abs(new_kcal - current_kcal) > VERIFY_TOLERANCE:
+                reviews.append((pid, name, current_kcal, new_kcal))
+
+        await repository.save_verification_batch([pid for pid, _, _ in answered], reviews)
+        skipped.update(pid for pid, name, _ in products if ai_kcal.get(name) is None)
+        checked += len(answered)
+        flagged += len(reviews)
+
+    await repository.set_job_state(VERIFY_JOB, None)
+    logging.info(
+        f"Verification pass finished: {checked} products checked, {flagged} sent to review, "
+        f"{len(skipped)} without an answer left for the next pass"
+    )
 
 async def sync_to_google_doc_job():
-    """Собирает отчет за день и отправляет в Google Doc."""
-    from config import USER_TZ
+    """Собирает отчеты всех пользователей за день и отправляет в Google Doc."""
     doc_id = os.getenv("GOOGLE_DOC_ID")
     if not doc_id:
         print("GOOGLE_DOC_ID not set, skipping sync.")
         return
 
-    # 1. Получаем список всех пользователей (в MVP - одного, но сделаем правильно)
-    async with aiosqlite.connect(db.DB_PATH) as conn:
-        async with conn.execute("SELECT id FROM users") as cursor:
-            users = await cursor.fetchall()
-            print(f"DEBUG: Found {len(users)} users for sync: {users}")
-
+    started = time.perf_counter()
     # Job runs for TODAY for all users
     today = datetime.now(USER_TZ).date()
-    
-    for (user_id,) in users:
-        await sync_user_day(user_id, today, doc_id)
+
+    # 1. Записи всех пользователей за день — одним запросом
+    logs_by_user = await repository.get_logs_for_date(today)
+    if not logs_by_user:
+        print(f"No logs for {today} to sync.")
+        return
+
+    # 2. Отчеты ставятся в очередь; уже отправленный текст повторно не попадет в документ
+    entries = []
+    for user_id, logs in logs_by_user.items():
+        entries.append((user_id, today, doc_id, await report.generate_day_report(logs)))
+    queued = await sync_outbox.enqueue(entries)
+
+    # 3. Отправка: отчеты одного документа — одним (или несколькими при большом объеме) batchUpdate
+    delivered = await sync_outbox.drain()
+    logging.info(
+        f"Nightly sync {today}: {queued}/{len(entries)} reports queued, {delivered} delivered "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
 
 async def sync_user_day(user_id, date, doc_id):
-    """Синхронизирует данные конкретного пользователя за конкретную дату."""
+    """
+    Ставит отчет пользователя за дату в очередь отправки в Google Doc.
+    Возвращает True, если отчет поставлен, False — если такой же уже отправлен или ждет отправки, None — если записей нет.
+    """
     logs = await repository.get_daily_logs(user_id, date)
-    if logs:
-        report_text = await report.generate_day_report(logs)
-        success = await google_sync.append_to_doc(doc_id, report_text)
-        if success:
-            print(f"Sync successful for user {user_id} date {date}")
-            return True
-        else:
-            print(f"Sync failed for user {user_id} date {date}")
-            return False
-    else:
+    if not logs:
         print(f"No logs for {date} to sync.")
-        return False
+        return None
+    report_text = await report.generate_day_report(logs)
+    return await sync_outbox.enqueue([(user_id, date, doc_id, report_text)]) > 0
+
+async def sync_user_range(user_id, start, end, doc_id, progress=None):
+    """
+    Ставит в очередь отчеты пользователя за каждый день периода [start, end] (одним запросом к БД).
+    progress — необязательная корутина progress(день, готово_дней, всего_дней) для отображения хода.
+    Возвращает (дней с записями, поставлено в очередь).
+    """
+    total_days = (end - start).days + 1
+    entries = []
+    async for day, logs in repository.get_logs_range(user_id, start, end):
+        entries.append((user_id, day, doc_id, await report.generate_day_report(logs)))
+        if progress:
+            await progress(day, (day - start).days + 1, total_days)
+    if not entries:
+        return 0, 0
+    # Отчеты уходят в документ по порядку дат, пачками batchUpdate с ограничением размера
+    return len(entries), await sync_outbox.enqueue(entries)
 
-def start_scheduler():
+async def maintenance_job():
+    """Переносит старые записи в архив, затем освобождает место, обновляет статистику и сбрасывает WAL."""
+    started = time.perf_counter()
+    cutoff = datetime.now(USER_TZ).date() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    logs, meals = await repository.archive_logs_before(cutoff)
+    sizes = await db.run_maintenance()
+    files = ", ".join(
+        f"{schema} {before / 1e6:.1f}->{after / 1e6:.1f} MB ({free} free pages)"
+        for schema, (before, after, free) in sizes.items()
+    )
+    logging.info(
+        f"DB maintenance: archived {logs} logs and {meals} meals before {cutoff}; {files}; "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+async def start_scheduler():
     scheduler.add_job(verify_calories_job, 'interval', weeks=1)
+    # Проход проверки, прерванный перезапуском, продолжается сразу, а не через неделю работы
+    if await repository.get_job_state(VERIFY_JOB) is not None:
+        run_at = datetime.now(USER_TZ) + timedelta(seconds=VERIFY_RESUME_DELAY)
+        scheduler.add_job(verify_calories_job, 'date', run_date=run_at)
+        logging.info(f"Verification: unfinished pass will resume at {run_at:%H:%M:%S}")
     
     # Синхронизация в конце дня (23:55)
     scheduler.add_job(sync_to_google_doc_job, 'cron', hour=23, minute=55)
+
+    # Архив и обслуживание базы
+    scheduler.add_job(maintenance_job, 'cron', hour=MAINTENANCE_HOUR, minute=0)
     
     scheduler.start()